@@ -1,26 +1,27 @@
-import json
+import orjson
 import boto3
 import os
 import logging
-from boto3.dynamodb.conditions import Key, Attr
-from datetime import datetime, timedelta
-from decimal import Decimal
-
-# Import auth module from Lambda layer
-import auth
-
-# Custom JSON encoder to handle Decimal types
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return float(obj)
-        return super(DecimalEncoder, self).default(obj)
+from botocore.config import Config
+from common import from_item
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize DynamoDB resources
+# The auth module from the Lambda layer loads PyJWT and the JWKS on import,
+# so it is only imported once a request actually needs authenticating
+auth = None
+
+def get_auth():
+    """
+    Returns the auth module from the Lambda layer, importing it on first use
+    """
+    global auth
+    if auth is None:
+        import auth as auth_module
+        auth = auth_module
+    return auth
 
 # Initialize DynamoDB client
 # Check if running locally
@@ -30,14 +31,87 @@ if 'AWS_SAM_LOCAL' in os.environ or 'LAMBDA_TASK_ROOT' not in os.environ:
     endpoint_url = 'http://localhost:8000'
     logger.info(f"Using local DynamoDB endpoint: {endpoint_url}")
 
-dynamodb = boto3.resource('dynamodb', endpoint_url=endpoint_url)
 table_name = os.environ.get('TELEMETRY_TABLE', 'TelemetryTable')
 
 # Make sure table_name is not None
 if not table_name:
     table_name = 'TelemetryTable'
     
-table = dynamodb.Table(table_name)
+# Connection settings for the DynamoDB client. Keep-alive and a larger
+# pool let a warm container reuse its TLS connections across invocations;
+# short timeouts fail over to a retry instead of hanging on a dead socket.
+dynamodb_config = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    connect_timeout=1,
+    read_timeout=3,
+    retries={'max_attempts': 5, 'mode': 'adaptive'}
+)
+
+# The low-level DynamoDB client is created on first use so requests that
+# never reach the table (CORS preflight, auth failures) skip the client setup
+dynamodb = None
+
+def get_dynamodb():
+    """
+    Returns the DynamoDB client, creating it on first use
+    """
+    global dynamodb
+    if dynamodb is None:
+        dynamodb = boto3.client('dynamodb', endpoint_url=endpoint_url, config=dynamodb_config)
+    return dynamodb
+
+# Largest Query page requested for a limited query, so a small limit does
+# not read (and pay for) a full 1 MB page
+MAX_PAGE_SIZE = 1000
+
+def encode_telemetry(device_id, pages):
+    """
+    Encodes the telemetry response body page by page
+    
+    Items are serialized as they arrive instead of being collected into a
+    list first, so only one page is held in memory besides the output.
+    
+    Returns:
+        tuple: The JSON body and the number of telemetry records
+    """
+    body = bytearray(b'{"deviceId":')
+    body += orjson.dumps(device_id)
+    body += b',"telemetry":['
+    
+    count = 0
+    for page in pages:
+        for item in page.get('Items', []):
+            if count:
+                body += b','
+            body += orjson.dumps(from_item(item))
+            count += 1
+    
+    body += b'],"count":%d}' % count
+    return body.decode(), count
+
+# Response headers shared by every response
+CORS_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
+}
+
+# CORS preflight response, returned as-is
+OPTIONS_RESPONSE = {
+    'statusCode': 200,
+    'headers': CORS_HEADERS,
+    'body': '{}'
+}
+
+def create_response(status_code, body):
+    """Create a JSON response with the CORS headers"""
+    return {
+        'statusCode': status_code,
+        'headers': CORS_HEADERS,
+        'body': orjson.dumps(body).decode()
+    }
 
 # Trigger redeployment and improve error handling for authentication
 def lambda_handler(event, context):
@@ -49,142 +123,108 @@ def lambda_handler(event, context):
     - startTime: Filter by start time (ISO 8601 format, optional)
     - endTime: Filter by end time (ISO 8601 format, optional)
     """
+    # Answer CORS preflight before doing any other work
+    if event.get('httpMethod') == 'OPTIONS':
+        return OPTIONS_RESPONSE
+    
     try:
         # Log the incoming event for debugging
         logger.info(f"Received event: {event}")
         
-        # Check if this is an OPTIONS request (CORS preflight)
-        if event.get('httpMethod') == 'OPTIONS':
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-                },
-                'body': json.dumps({})
-            }
-            
         # Validate JWT token
         try:
-            claims = auth.require_auth(event)
-            logger.info(f"Authenticated user: {claims.get('username') if claims else 'None'} (CORS preflight)")
+            claims = get_auth().require_auth(event)
+            logger.info(f"Authenticated user: {claims.get('username') or claims.get('cognito:username')}")
         except Exception as e:
             logger.error(f"Authentication error: {str(e)}")
-            return {
-                'statusCode': 401,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-                },
-                'body': json.dumps({
-                    'error': 'Unauthorized',
-                    'message': str(e)
-                }, cls=DecimalEncoder)
-            }
+            return create_response(401, {
+                'error': 'Unauthorized',
+                'message': str(e)
+            })
         
         # Get query parameters
         query_params = event.get('queryStringParameters', {})
         if not query_params:
             logger.error("Missing query parameters")
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-                },
-                'body': json.dumps({
-                    'error': 'Missing query parameters'
-                })
-            }
+            return create_response(400, {
+                'error': 'Missing query parameters'
+            })
             
         logger.info(f"Query parameters: {query_params}")
         
         # Check for required deviceId
         if 'deviceId' not in query_params:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-                },
-                'body': json.dumps({
-                    'error': 'Missing required parameter: deviceId'
-                })
-            }
+            return create_response(400, {
+                'error': 'Missing required parameter: deviceId'
+            })
         
         device_id = query_params['deviceId']
         
+        # Build the sort key condition for the time range, if any
+        # ('timestamp' is a DynamoDB reserved word)
+        start_time = query_params.get('startTime')
+        end_time = query_params.get('endTime')
+        if start_time and end_time:
+            range_condition = '#timestamp BETWEEN :startTime AND :endTime'
+        elif start_time:
+            range_condition = '#timestamp >= :startTime'
+        elif end_time:
+            range_condition = '#timestamp <= :endTime'
+        else:
+            range_condition = None
+        
         # Build query parameters
+        expression_values = {':deviceId': {'S': device_id}}
         query_kwargs = {
-            'KeyConditionExpression': Key('deviceId').eq(device_id)
+            'TableName': table_name,
+            'KeyConditionExpression': 'deviceId = :deviceId',
+            'ExpressionAttributeValues': expression_values
         }
         
-        # Add time range if specified
-        if 'startTime' in query_params and 'endTime' in query_params:
-            start_time = query_params['startTime']
-            end_time = query_params['endTime']
-            query_kwargs['KeyConditionExpression'] = Key('deviceId').eq(device_id) & \
-                                                    Key('timestamp').between(start_time, end_time)
-        elif 'startTime' in query_params:
-            start_time = query_params['startTime']
-            query_kwargs['KeyConditionExpression'] = Key('deviceId').eq(device_id) & \
-                                                    Key('timestamp').gte(start_time)
-        elif 'endTime' in query_params:
-            end_time = query_params['endTime']
-            query_kwargs['KeyConditionExpression'] = Key('deviceId').eq(device_id) & \
-                                                    Key('timestamp').lte(end_time)
+        if range_condition:
+            query_kwargs['KeyConditionExpression'] += ' AND ' + range_condition
+            query_kwargs['ExpressionAttributeNames'] = {'#timestamp': 'timestamp'}
+            if start_time:
+                expression_values[':startTime'] = {'S': start_time}
+            if end_time:
+                expression_values[':endTime'] = {'S': end_time}
         
-        # Set limit if specified
+        # Set limit if specified. The limit caps the total across pages and
+        # the size of each page read.
+        pagination_config = {}
         if 'limit' in query_params:
             try:
                 limit = int(query_params['limit'])
-                query_kwargs['Limit'] = limit
             except ValueError:
                 logger.warning(f"Invalid limit parameter: {query_params['limit']}")
+            else:
+                if limit <= 0:
+                    return create_response(400, {
+                        'error': 'limit must be a positive integer'
+                    })
+                pagination_config['MaxItems'] = limit
+                pagination_config['PageSize'] = min(limit, MAX_PAGE_SIZE)
         
-        # Query DynamoDB
-        response = table.query(**query_kwargs)
-        items = response.get('Items', [])
+        # Query DynamoDB, following LastEvaluatedKey across pages
+        pages = get_dynamodb().get_paginator('query').paginate(
+            PaginationConfig=pagination_config,
+            **query_kwargs
+        )
+        body, count = encode_telemetry(device_id, pages)
         
-        logger.info(f"Retrieved {len(items)} telemetry records for device {device_id}")
+        logger.info(f"Retrieved {count} telemetry records for device {device_id}")
         
         return {
             'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-            },
-            'body': json.dumps({
-                'deviceId': device_id,
-                'count': len(items),
-                'telemetry': items
-            }, cls=DecimalEncoder)
+            'headers': CORS_HEADERS,
+            'body': body
         }
         
     except Exception as e:
         logger.error(f"Error retrieving telemetry data: {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-            },
-            'body': json.dumps({
-                'error': 'Internal server error',
-                'message': str(e)
-            }, cls=DecimalEncoder)
-        }
+        return create_response(500, {
+            'error': 'Internal server error',
+            'message': str(e)
+        })
@@ -1,17 +1,33 @@
-import json
+import orjson
 import boto3
 import os
+import time
+import base64
+import binascii
 import logging
-from datetime import datetime
-from decimal import Decimal
-
-# Import auth module from Lambda layer
-import auth
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# The auth module from the Lambda layer loads PyJWT and the JWKS on import,
+# so it is only imported once a request actually needs authenticating
+auth = None
+
+def get_auth():
+    """
+    Returns the auth module from the Lambda layer, importing it on first use
+    """
+    global auth
+    if auth is None:
+        import auth as auth_module
+        auth = auth_module
+    return auth
+
 # Initialize DynamoDB client
 # Check if running locally
 endpoint_url = None
@@ -20,19 +36,284 @@ if 'AWS_SAM_LOCAL' in os.environ or 'LAMBDA_TASK_ROOT' not in os.environ:
     endpoint_url = 'http://localhost:8000'
     logger.info(f"Using local DynamoDB endpoint: {endpoint_url}")
 
-dynamodb = boto3.resource('dynamodb', endpoint_url=endpoint_url)
 table_name = os.environ.get('TELEMETRY_TABLE', 'TelemetryTable')
 
 # Make sure table_name is not None
 if not table_name:
     table_name = 'TelemetryTable'
+
+# Holds the most recent telemetry record of each device for list-devices
+latest_table_name = os.environ.get('LATEST_TELEMETRY_TABLE') or 'LatestTelemetryTable'
     
-table = dynamodb.Table(table_name)
+# Connection settings for the DynamoDB client. Keep-alive and a larger
+# pool let a warm container reuse its TLS connections across invocations;
+# short timeouts fail over to a retry instead of hanging on a dead socket.
+dynamodb_config = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    connect_timeout=1,
+    read_timeout=3,
+    retries={'max_attempts': 5, 'mode': 'adaptive'}
+)
+
+# The low-level DynamoDB client is created on first use so requests that
+# never reach the table (CORS preflight, auth failures) skip the client setup
+dynamodb = None
+
+def get_dynamodb():
+    """
+    Returns the DynamoDB client, creating it on first use
+    """
+    global dynamodb
+    if dynamodb is None:
+        dynamodb = boto3.client('dynamodb', endpoint_url=endpoint_url, config=dynamodb_config)
+    return dynamodb
+
+def to_attribute_value(value):
+    """
+    Converts a value parsed from the JSON request body to a DynamoDB AttributeValue
+    """
+    # Exact type checks: orjson only produces these builtins, most telemetry
+    # values are numbers, and type(True) is bool, not int
+    value_type = type(value)
+    if value_type is float or value_type is int:
+        return {'N': str(value)}
+    if value_type is str:
+        return {'S': value}
+    if value_type is bool:
+        return {'BOOL': value}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, dict):
+        return {'M': {k: to_attribute_value(v) for k, v in value.items()}}
+    if isinstance(value, list):
+        return {'L': [to_attribute_value(v) for v in value]}
+    raise TypeError(f'Unsupported telemetry value type: {type(value).__name__}')
+
+# Response headers shared by every response
+CORS_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
+}
+
+# CORS preflight response, returned as-is
+OPTIONS_RESPONSE = {
+    'statusCode': 200,
+    'headers': CORS_HEADERS,
+    'body': '{}'
+}
+
+def create_response(status_code, body):
+    """Create a JSON response with the CORS headers"""
+    return {
+        'statusCode': status_code,
+        'headers': CORS_HEADERS,
+        'body': orjson.dumps(body).decode()
+    }
+
+# Fields every telemetry message must carry
+REQUIRED_FIELDS = ['deviceId', 'latitude', 'longitude', 'temperature']
+
+# Required fields stored as DynamoDB numbers
+NUMERIC_FIELDS = ['latitude', 'longitude', 'temperature']
+
+# Server-side timestamps always carry microseconds so they sort correctly
+# as strings against each other in the timestamp sort key
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+# BatchWriteItem accepts at most 25 items per request
+BATCH_WRITE_SIZE = 25
+BATCH_WRITE_MAX_ATTEMPTS = 5
+
+# Maximum number of latest telemetry snapshots written concurrently
+LATEST_WRITE_WORKERS = 10
+
+def validate_telemetry(request_body):
+    """
+    Checks that a telemetry message has the required fields with the right types
+    
+    Raises:
+        ValueError: If the message is not an object or a field is missing or invalid
+    """
+    if not isinstance(request_body, dict):
+        raise ValueError('Telemetry message must be a JSON object')
+    for field in REQUIRED_FIELDS:
+        if field not in request_body:
+            raise ValueError(f'Missing required field: {field}')
+    
+    if not isinstance(request_body['deviceId'], str) or not request_body['deviceId']:
+        raise ValueError('deviceId must be a non-empty string')
+    if 'timestamp' in request_body and (not isinstance(request_body['timestamp'], str) or not request_body['timestamp']):
+        raise ValueError('timestamp must be a non-empty string')
+    for field in NUMERIC_FIELDS:
+        # bool is a subclass of int but is not a valid reading
+        value = request_body[field]
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f'{field} must be a number')
+
+def build_telemetry_item(request_body):
+    """
+    Builds the DynamoDB item for a validated telemetry message
+    
+    Uses the current time when the message carries no timestamp.
+    """
+    # Use provided timestamp or current time
+    if 'timestamp' in request_body:
+        timestamp = request_body['timestamp']
+    else:
+        timestamp = datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)
+    
+    telemetry_item = {
+        'deviceId': {'S': request_body['deviceId']},
+        'timestamp': {'S': timestamp},
+        'latitude': {'N': str(request_body['latitude'])},
+        'longitude': {'N': str(request_body['longitude'])},
+        'temperature': {'N': str(request_body['temperature'])}
+    }
+    
+    # Add optional fields if present
+    for key, value in request_body.items():
+        if key not in telemetry_item:
+            telemetry_item[key] = to_attribute_value(value)
+    
+    return telemetry_item
+
+def write_telemetry_batch(items):
+    """
+    Stores telemetry items with BatchWriteItem, retrying unprocessed items
+    
+    Returns:
+        list: The items that could not be written after all retries
+    """
+    failed_items = []
+    
+    for i in range(0, len(items), BATCH_WRITE_SIZE):
+        requests = [{'PutRequest': {'Item': item}} for item in items[i:i + BATCH_WRITE_SIZE]]
+        
+        for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+            response = get_dynamodb().batch_write_item(RequestItems={table_name: requests})
+            requests = response.get('UnprocessedItems', {}).get(table_name, [])
+            if not requests:
+                break
+            if attempt < BATCH_WRITE_MAX_ATTEMPTS - 1:
+                # Back off before retrying throttled items
+                time.sleep(min(0.05 * 2 ** attempt, 1))
+        
+        failed_items.extend(request['PutRequest']['Item'] for request in requests)
+    
+    return failed_items
+
+def put_latest_telemetry(item):
+    """
+    Stores a telemetry item as its device's latest snapshot unless the
+    snapshot already holds a newer (or the same) reading
+    
+    Returns:
+        bool: False if the item could not be written because of an error
+    """
+    try:
+        get_dynamodb().put_item(
+            TableName=latest_table_name,
+            Item=item,
+            ConditionExpression='attribute_not_exists(deviceId) OR #ts < :ts',
+            ExpressionAttributeNames={'#ts': 'timestamp'},
+            ExpressionAttributeValues={':ts': item['timestamp']}
+        )
+    except ClientError as e:
+        # A newer reading is already stored; backfilled or delayed messages
+        # must not replace it
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return True
+        logger.error(f"Error updating latest telemetry for device {item['deviceId']['S']}: {str(e)}")
+        return False
+    return True
+
+def store_latest_telemetry(items):
+    """
+    Records the newest of the given telemetry items of each device in the
+    latest telemetry table
+    
+    Each write is conditional on the stored snapshot being older, so
+    out-of-order messages never overwrite a newer reading. The snapshot is
+    best effort: the telemetry table stays the source of truth, so failures
+    are logged rather than failing the request.
+    """
+    latest_items = {}
+    for item in items:
+        device_id = item['deviceId']['S']
+        if device_id not in latest_items or item['timestamp']['S'] > latest_items[device_id]['timestamp']['S']:
+            latest_items[device_id] = item
+    
+    if not latest_items:
+        return
+    
+    if len(latest_items) == 1:
+        results = [put_latest_telemetry(next(iter(latest_items.values())))]
+    else:
+        with ThreadPoolExecutor(max_workers=min(LATEST_WRITE_WORKERS, len(latest_items))) as executor:
+            results = list(executor.map(put_latest_telemetry, latest_items.values()))
+    
+    failed = results.count(False)
+    if failed:
+        logger.error(f"Could not update latest telemetry for {failed} devices")
+
+def parse_record(record):
+    """
+    Extracts and validates the telemetry message from an SQS or Kinesis record
+    """
+    if 'kinesis' in record:
+        message = orjson.loads(base64.b64decode(record['kinesis']['data'], validate=True))
+    else:
+        message = orjson.loads(record['body'])
+    validate_telemetry(message)
+    return message
+
+def handle_records(event):
+    """
+    Stores the telemetry messages of an SQS or Kinesis batch
+    
+    Invalid messages are logged and dropped. Messages that can't be written
+    are reported as batch item failures so the event source retries them;
+    any other error propagates so the whole batch is retried.
+    """
+    items = {}
+    record_ids = {}
+    
+    for record in event['Records']:
+        record_id = record.get('messageId') or record.get('kinesis', {}).get('sequenceNumber')
+        try:
+            request_body = parse_record(record)
+            telemetry_item = build_telemetry_item(request_body)
+        except (ValueError, TypeError, KeyError, binascii.Error, UnicodeDecodeError) as e:
+            logger.error(f"Skipping invalid telemetry record {record_id}: {str(e)}")
+            continue
+        
+        # A batch can't hold the same key twice; the latest message wins
+        key = (telemetry_item['deviceId']['S'], telemetry_item['timestamp']['S'])
+        items[key] = telemetry_item
+        record_ids[key] = record_id
+    
+    failed_items = write_telemetry_batch(list(items.values()))
+    store_latest_telemetry(items.values())
+    
+    logger.info(f"Stored {len(items) - len(failed_items)} of {len(event['Records'])} telemetry records")
+    
+    return {
+        'batchItemFailures': [
+            {'itemIdentifier': record_ids[(item['deviceId']['S'], item['timestamp']['S'])]}
+            for item in failed_items
+        ]
+    }
 
 def lambda_handler(event, context):
     """
     Handles incoming telemetry data and stores it in DynamoDB
     
+    Accepts single messages through API Gateway and batches of messages
+    from SQS or Kinesis ('Records' events).
+    
     Expected JSON format:
     {
         "deviceId": "device123",
@@ -42,159 +323,77 @@ def lambda_handler(event, context):
         "timestamp": "2023-05-22T14:30:00Z" (optional, will use current time if not provided)
     }
     """
+    # Answer CORS preflight before doing any other work
+    if event.get('httpMethod') == 'OPTIONS':
+        return OPTIONS_RESPONSE
+    
+    # Log the incoming event for debugging
+    logger.info(f"Received event: {event}")
+    
+    # Batches from SQS or Kinesis are authorized by the event source mapping.
+    # They are handled outside the try below: an error response without
+    # batchItemFailures would tell the event source the whole batch succeeded
+    if 'Records' in event:
+        return handle_records(event)
+    
     try:
-        # Log the incoming event for debugging
-        logger.info(f"Received event: {event}")
-        
-        # Check if this is an OPTIONS request (CORS preflight)
-        if event.get('httpMethod') == 'OPTIONS':
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-                },
-                'body': json.dumps({})
-            }
-            
         # Validate JWT token
         try:
-            claims = auth.require_auth(event)
+            claims = get_auth().require_auth(event)
             logger.info(f"Authenticated user: {claims.get('username') if claims else 'None'} (CORS preflight)")
         except Exception as e:
             logger.error(f"Authentication error: {str(e)}")
-            return {
-                'statusCode': 401,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-                },
-                'body': json.dumps({
-                    'error': 'Unauthorized',
-                    'message': str(e)
-                })
-            }
+            return create_response(401, {
+                'error': 'Unauthorized',
+                'message': str(e)
+            })
         
         # Parse request body
         if not event.get('body'):
             logger.error("Missing request body")
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-                },
-                'body': json.dumps({
-                    'error': 'Missing request body'
-                })
-            }
+            return create_response(400, {
+                'error': 'Missing request body'
+            })
             
         try:
-            request_body = json.loads(event['body'])
+            request_body = orjson.loads(event['body'])
             logger.info(f"Request body: {request_body}")
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Error parsing request body: {str(e)}")
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-                },
-                'body': json.dumps({
-                    'error': f'Invalid JSON in request body: {str(e)}'
-                })
-            }
+            return create_response(400, {
+                'error': f'Invalid JSON in request body: {str(e)}'
+            })
         
         # Validate required fields
-        required_fields = ['deviceId', 'latitude', 'longitude', 'temperature']
-        for field in required_fields:
-            if field not in request_body:
-                logger.error(f"Missing required field: {field}")
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*',
-                        'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                        'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-                    },
-                    'body': json.dumps({
-                        'error': f'Missing required field: {field}'
-                    })
-                }
+        try:
+            validate_telemetry(request_body)
+        except ValueError as e:
+            logger.error(f"Invalid telemetry data: {str(e)}")
+            return create_response(400, {
+                'error': str(e)
+            })
         
-        # Extract telemetry data
         device_id = request_body['deviceId']
-        latitude = request_body['latitude']
-        longitude = request_body['longitude']
-        temperature = request_body['temperature']
-        
-        # Use provided timestamp or current time
-        if 'timestamp' in request_body:
-            timestamp = request_body['timestamp']
-        else:
-            timestamp = datetime.utcnow().isoformat() + 'Z'
-        
-        # Create item for DynamoDB
-        telemetry_item = {
-            'deviceId': device_id,
-            'timestamp': timestamp,
-            'latitude': Decimal(str(latitude)),
-            'longitude': Decimal(str(longitude)),
-            'temperature': Decimal(str(temperature))
-        }
-        
-        # Add optional fields if present
-        for key, value in request_body.items():
-            if key not in telemetry_item:
-                # Convert float values to Decimal for DynamoDB
-                if isinstance(value, float):
-                    telemetry_item[key] = Decimal(str(value))
-                else:
-                    telemetry_item[key] = value
+        telemetry_item = build_telemetry_item(request_body)
+        timestamp = telemetry_item['timestamp']['S']
         
         # Store in DynamoDB
-        table.put_item(Item=telemetry_item)
+        get_dynamodb().put_item(TableName=table_name, Item=telemetry_item)
+        store_latest_telemetry([telemetry_item])
         
         logger.info(f"Stored telemetry data for device {device_id}")
         
-        return {
-            'statusCode': 201,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-            },
-            'body': json.dumps({
-                'message': 'Telemetry data stored successfully',
-                'deviceId': device_id,
-                'timestamp': timestamp
-            })
-        }
+        return create_response(201, {
+            'message': 'Telemetry data stored successfully',
+            'deviceId': device_id,
+            'timestamp': timestamp
+        })
         
     except Exception as e:
         logger.error(f"Error processing telemetry data: {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-            },
-            'body': json.dumps({
-                'error': 'Internal server error',
-                'message': str(e)
-            })
-        }
+        return create_response(500, {
+            'error': 'Internal server error',
+            'message': str(e)
+        })
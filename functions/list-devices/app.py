@@ -1,43 +1,160 @@
-import json
+import orjson
 import boto3
 import os
+import time
 import logging
-from boto3.dynamodb.conditions import Key, Attr
-from decimal import Decimal
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from common import from_item
 
-# Import auth module from Lambda layer
-import auth
+# Response headers shared by every response
+CORS_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+    'Access-Control-Allow-Methods': 'OPTIONS,GET'
+}
 
-# Custom JSON encoder to handle Decimal types
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return float(obj)
-        return super(DecimalEncoder, self).default(obj)
+# CORS preflight response, returned as-is
+OPTIONS_RESPONSE = {
+    'statusCode': 200,
+    'headers': CORS_HEADERS,
+    'body': '{}'
+}
+
+def create_response(status_code, body):
+    """Create a JSON response with the CORS headers"""
+    return {
+        'statusCode': status_code,
+        'headers': CORS_HEADERS,
+        'body': orjson.dumps(body).decode()
+    }
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize DynamoDB resources
+# The auth module from the Lambda layer loads PyJWT and the JWKS on import,
+# so it is only imported once a request actually needs authenticating
+auth = None
+
+def get_auth():
+    """
+    Returns the auth module from the Lambda layer, importing it on first use
+    """
+    global auth
+    if auth is None:
+        import auth as auth_module
+        auth = auth_module
+    return auth
+
+# Initialize DynamoDB client
 endpoint_url = None
 if 'AWS_SAM_LOCAL' in os.environ or 'LAMBDA_TASK_ROOT' not in os.environ:
     # Local development
     endpoint_url = 'http://localhost:8000'
     logger.info(f"Using local DynamoDB endpoint: {endpoint_url}")
 
-dynamodb = boto3.resource('dynamodb', endpoint_url=endpoint_url)
+# Connection settings for the DynamoDB client. Keep-alive lets a warm
+# container reuse its TLS connections across invocations, and the pool is
+# sized for the concurrent company queries.
+dynamodb_config = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    connect_timeout=1,
+    read_timeout=3,
+    retries={'max_attempts': 5, 'mode': 'adaptive'}
+)
+
+# The low-level client is thread-safe, so the concurrent queries share it
+dynamodb = boto3.client('dynamodb', endpoint_url=endpoint_url, config=dynamodb_config)
 device_table_name = os.environ.get('DEVICE_TABLE', 'DeviceTable')
-telemetry_table_name = os.environ.get('TELEMETRY_TABLE', 'TelemetryTable')
+latest_table_name = os.environ.get('LATEST_TELEMETRY_TABLE') or 'LatestTelemetryTable'
+user_company_table_name = os.environ.get('USER_COMPANY_TABLE') or 'UserCompanyTable'
 
 # Make sure table names are not None
 if not device_table_name:
     device_table_name = 'DeviceTable'
-if not telemetry_table_name:
-    telemetry_table_name = 'TelemetryTable'
+
+# Only the attributes the web and mobile device lists read are fetched
+# ('name' and 'timestamp' are DynamoDB reserved words)
+DEVICE_PROJECTION = 'deviceId, #name, description, companyId'
+DEVICE_PROJECTION_NAMES = {'#name': 'name'}
+TELEMETRY_PROJECTION = 'deviceId, #timestamp, latitude, longitude, temperature, humidity'
+TELEMETRY_PROJECTION_NAMES = {'#timestamp': 'timestamp'}
+
+# Maximum number of concurrent DynamoDB queries
+QUERY_WORKERS = 32
+
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_SIZE = 100
+BATCH_GET_MAX_ATTEMPTS = 5
+
+def query_company_devices(company_id):
+    """
+    Queries the CompanyIndex for all devices of a company, following pagination
+    """
+    devices = []
+    paginator = dynamodb.get_paginator('query')
+    for page in paginator.paginate(
+        TableName=device_table_name,
+        IndexName='CompanyIndex',
+        KeyConditionExpression='companyId = :companyId',
+        ExpressionAttributeValues={':companyId': {'S': company_id}},
+        ProjectionExpression=DEVICE_PROJECTION,
+        ExpressionAttributeNames=DEVICE_PROJECTION_NAMES
+    ):
+        devices.extend(from_item(item) for item in page.get('Items', []))
+    return devices
+
+def get_user_company_ids(user_id):
+    """
+    Queries the user-company table for the IDs of the companies a user belongs to
+    """
+    company_ids = []
+    paginator = dynamodb.get_paginator('query')
+    for page in paginator.paginate(
+        TableName=user_company_table_name,
+        KeyConditionExpression='userId = :userId',
+        ExpressionAttributeValues={':userId': {'S': user_id}},
+        ProjectionExpression='companyId'
+    ):
+        company_ids.extend(item['companyId']['S'] for item in page.get('Items', []))
+    return company_ids
+
+def get_latest_telemetry(device_ids):
+    """
+    Fetches the latest telemetry record of each device from the latest
+    telemetry table with BatchGetItem
     
-device_table = dynamodb.Table(device_table_name)
-telemetry_table = dynamodb.Table(telemetry_table_name)
+    Returns:
+        dict: The latest telemetry record by device ID, for the devices found
+    """
+    latest_telemetry = {}
+    # BatchGetItem rejects duplicate keys
+    keys = [{'deviceId': {'S': device_id}} for device_id in dict.fromkeys(device_ids)]
+    
+    for i in range(0, len(keys), BATCH_GET_SIZE):
+        request_items = {
+            latest_table_name: {
+                'Keys': keys[i:i + BATCH_GET_SIZE],
+                'ProjectionExpression': TELEMETRY_PROJECTION,
+                'ExpressionAttributeNames': TELEMETRY_PROJECTION_NAMES
+            }
+        }
+        
+        for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            for item in response.get('Responses', {}).get(latest_table_name, []):
+                latest_telemetry[item['deviceId']['S']] = from_item(item)
+            request_items = response.get('UnprocessedKeys')
+            if not request_items:
+                break
+            if attempt < BATCH_GET_MAX_ATTEMPTS - 1:
+                # Back off before retrying throttled keys
+                time.sleep(min(0.05 * 2 ** attempt, 1))
+    
+    return latest_telemetry
 
 def lambda_handler(event, context):
     """
@@ -46,111 +163,67 @@ def lambda_handler(event, context):
     Query parameters:
     - companyId: Filter by company ID (optional)
     """
+    # Answer CORS preflight before doing any other work
+    if event.get('httpMethod') == 'OPTIONS':
+        return OPTIONS_RESPONSE
+    
     try:
-        # Log the incoming event for debugging
-        logger.info(f"Received event: {event}")
+        # Log the incoming event for debugging (formatted only at DEBUG level)
+        logger.debug("Received event: %s", event)
         
-        # Check if this is an OPTIONS request (CORS preflight)
-        if event.get('httpMethod') == 'OPTIONS':
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'OPTIONS,GET'
-                },
-                'body': json.dumps({})
-            }
-            
         # Validate JWT token
         try:
-            claims = auth.require_auth(event)
+            claims = get_auth().require_auth(event)
             logger.info(f"Authenticated user: {claims.get('username') if claims else 'None'}")
         except Exception as e:
             logger.error(f"Authentication error: {str(e)}")
-            return {
-                'statusCode': 401,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'OPTIONS,GET'
-                },
-                'body': json.dumps({
-                    'error': 'Unauthorized',
-                    'message': str(e)
-                }, cls=DecimalEncoder)
-            }
+            return create_response(401, {
+                'error': 'Unauthorized',
+                'message': str(e)
+            })
         
         # Get query parameters
         query_params = event.get('queryStringParameters', {}) or {}
-        logger.info(f"Query parameters: {query_params}")
+        logger.debug("Query parameters: %s", query_params)
         
-        # Get all devices from the device table
+        # Get the devices from the device table's CompanyIndex
         if 'companyId' in query_params:
             # Filter by company ID if provided
-            company_id = query_params['companyId']
-            response = device_table.query(
-                IndexName="CompanyIndex",
-                KeyConditionExpression=Key('companyId').eq(company_id)
-            )
+            devices = query_company_devices(query_params['companyId'])
         else:
-            # Get all devices if no company ID is provided
-            response = device_table.scan()
-            
-        devices = response.get('Items', [])
+            # Get the devices of all the user's companies if no company ID is provided
+            company_ids = get_user_company_ids(get_auth().get_user_id_from_token(claims))
+            devices = []
+            if company_ids:
+                with ThreadPoolExecutor(max_workers=min(QUERY_WORKERS, len(company_ids))) as executor:
+                    for company_devices in executor.map(query_company_devices, company_ids):
+                        devices.extend(company_devices)
+        
+        # Get the latest telemetry data of all devices in one batched lookup
+        try:
+            latest_telemetry = get_latest_telemetry(device['deviceId'] for device in devices)
+        except Exception as e:
+            logger.error(f"Error getting latest telemetry: {str(e)}")
+            latest_telemetry = {}
         
-        # For each device, get the latest telemetry data
+        # Devices without a snapshot have never reported; those that last
+        # reported before the table existed are filled in by
+        # scripts/backfill_latest_telemetry.py
         for device in devices:
-            device_id = device['deviceId']
-            try:
-                # Query the telemetry table to get the latest entry for this device
-                telemetry_response = telemetry_table.query(
-                    KeyConditionExpression=Key('deviceId').eq(device_id),
-                    ScanIndexForward=False,  # Sort in descending order (newest first)
-                    Limit=1  # Get only the latest record
-                )
-                
-                latest_telemetry = telemetry_response.get('Items', [])
-                if latest_telemetry:
-                    device['lastTelemetry'] = latest_telemetry[0]
-                else:
-                    device['lastTelemetry'] = None
-            except Exception as e:
-                logger.error(f"Error getting latest telemetry for device {device_id}: {str(e)}")
-                device['lastTelemetry'] = None
+            device['lastTelemetry'] = latest_telemetry.get(device['deviceId'])
                 
         logger.info(f"Retrieved {len(devices)} devices")
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                'Access-Control-Allow-Methods': 'OPTIONS,GET'
-            },
-            'body': json.dumps({
-                'count': len(devices),
-                'devices': devices
-            }, cls=DecimalEncoder)
-        }
+        return create_response(200, {
+            'count': len(devices),
+            'devices': devices
+        })
         
     except Exception as e:
         logger.error(f"Error retrieving devices: {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                'Access-Control-Allow-Methods': 'OPTIONS,GET'
-            },
-            'body': json.dumps({
-                'error': 'Internal server error',
-                'message': str(e)
-            }, cls=DecimalEncoder)
-        }
+        return create_response(500, {
+            'error': 'Internal server error',
+            'message': str(e)
+        })
@@ -1,40 +1,109 @@
-import json
+import orjson
 import os
 import uuid
 import boto3
 import logging
+from botocore.config import Config
 from datetime import datetime
+from decimal import Decimal
 from auth import validate_token, get_user_id_from_token
+from common import parse_body
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# orjson hook for the Decimal numbers DynamoDB returns
+def decimal_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError
+
+# Response headers shared by every response
+CORS_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
+    'Access-Control-Allow-Methods': 'GET,POST,PUT,DELETE,OPTIONS'
+}
+
+# CORS preflight response, returned as-is
+OPTIONS_RESPONSE = {
+    'statusCode': 200,
+    'headers': CORS_HEADERS,
+    'body': '{}'
+}
+
+def create_response(status_code, body):
+    """Create a JSON response with the CORS headers"""
+    return {
+        'statusCode': status_code,
+        'headers': CORS_HEADERS,
+        'body': orjson.dumps(body, default=decimal_default).decode()
+    }
+
+# Connection settings for the DynamoDB client. Keep-alive lets a warm
+# container reuse its TLS connections across invocations.
+dynamodb_config = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    connect_timeout=1,
+    read_timeout=3,
+    retries={'max_attempts': 5, 'mode': 'adaptive'}
+)
+
 # Initialize DynamoDB client
-dynamodb = boto3.resource('dynamodb')
+dynamodb = boto3.resource('dynamodb', config=dynamodb_config)
 company_table = dynamodb.Table(os.environ.get('COMPANY_TABLE'))
 user_company_table = dynamodb.Table(os.environ.get('USER_COMPANY_TABLE'))
 
+# Number of user-company associations read per page when deleting a company
+ASSOCIATION_PAGE_SIZE = 500
+
+def admin_condition_check(user_id, company_id):
+    """
+    Builds the transaction step that requires the user to be an admin of the company
+    
+    Putting the permission check in the same TransactWriteItems call as the
+    write saves the separate get_item round trip.
+    """
+    return {
+        'ConditionCheck': {
+            'TableName': user_company_table.name,
+            'Key': {
+                'userId': user_id,
+                'companyId': company_id
+            },
+            'ConditionExpression': '#role = :admin',
+            'ExpressionAttributeNames': {'#role': 'role'},
+            'ExpressionAttributeValues': {':admin': 'admin'}
+        }
+    }
+
+# Positions of the items in the update and delete transactions
+ADMIN_CHECK_INDEX = 0
+COMPANY_WRITE_INDEX = 1
+
+def failed_condition(error, index):
+    """
+    Tells whether the transaction item at the given index failed its
+    condition in a cancelled transaction
+    """
+    reasons = error.response.get('CancellationReasons', [])
+    return index < len(reasons) and reasons[index].get('Code') == 'ConditionalCheckFailed'
+
 def lambda_handler(event, context):
     """
     Lambda function to manage companies
     """
-    logger.info(f"Event: {json.dumps(event)}")
-    
-    # Define CORS headers to be used in all responses
-    cors_headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
-        'Access-Control-Allow-Methods': 'GET,POST,PUT,DELETE,OPTIONS'
-    }
-    
-    # Handle OPTIONS request for CORS
+    # Handle OPTIONS request for CORS before doing any other work
     if event.get('httpMethod') == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': cors_headers,
-            'body': json.dumps({})
-        }
+        return OPTIONS_RESPONSE
+    
+    # Log a one-line summary of the request; the full event only at DEBUG.
+    # Arguments are formatted lazily, only if the record is emitted.
+    logger.info("Request: %s %s", event.get('httpMethod'), event.get('path'))
+    logger.debug("Event: %s", event)
     
     # Validate token for non-OPTIONS requests
     try:
@@ -51,35 +120,25 @@ def lambda_handler(event, context):
         user_id = get_user_id_from_token(claims)
     except Exception as e:
         logger.error(f"Token validation error: {str(e)}")
-        return {
-            'statusCode': 401,
-            'headers': cors_headers,
-            'body': json.dumps({
-                'message': f'Unauthorized: {str(e)}'
-            })
-        }
+        return create_response(401, {
+            'message': f'Unauthorized: {str(e)}'
+        })
     
     # Handle different HTTP methods
     if event.get('httpMethod') == 'GET':
-        return get_company(event, user_id, cors_headers)
+        return get_company(event, user_id)
     elif event.get('httpMethod') == 'POST':
-        return create_company(event, user_id, cors_headers)
+        return create_company(event, user_id)
     elif event.get('httpMethod') == 'PUT':
-        return update_company(event, user_id, cors_headers)
+        return update_company(event, user_id)
     elif event.get('httpMethod') == 'DELETE':
-        return delete_company(event, user_id, cors_headers)
+        return delete_company(event, user_id)
     else:
-        headers = cors_headers.copy()
-        headers['Content-Type'] = 'application/json'
-        return {
-            'statusCode': 400,
-            'headers': headers,
-            'body': json.dumps({
-                'message': 'Unsupported HTTP method'
-            })
-        }
+        return create_response(400, {
+            'message': 'Unsupported HTTP method'
+        })
 
-def get_company(event, user_id, cors_headers):
+def get_company(event, user_id):
     """
     Get company details
     """
@@ -88,10 +147,6 @@ def get_company(event, user_id, cors_headers):
         query_params = event.get('queryStringParameters', {}) or {}
         company_id = query_params.get('companyId')
         
-        # Prepare headers with content type
-        headers = cors_headers.copy()
-        headers['Content-Type'] = 'application/json'
-        
         if company_id:
             # Get specific company
             response = company_table.get_item(
@@ -100,64 +155,39 @@ def get_company(event, user_id, cors_headers):
             company = response.get('Item')
             
             if not company:
-                return {
-                    'statusCode': 404,
-                    'headers': headers,
-                    'body': json.dumps({
-                        'message': 'Company not found'
-                    })
-                }
-                
-            return {
-                'statusCode': 200,
-                'headers': headers,
-                'body': json.dumps({
-                    'company': company
+                return create_response(404, {
+                    'message': 'Company not found'
                 })
-            }
+                
+            return create_response(200, {
+                'company': company
+            })
         else:
             # Get all companies for the user
             # This is a simplified approach - in a real app, you might want to use a query with GSI
-            return {
-                'statusCode': 400,
-                'headers': headers,
-                'body': json.dumps({
-                    'message': 'Company ID is required'
-                })
-            }
+            return create_response(400, {
+                'message': 'Company ID is required'
+            })
     except Exception as e:
         logger.error(f"Error getting company: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': headers,
-            'body': json.dumps({
-                'message': f'Error getting company: {str(e)}'
-            })
-        }
+        return create_response(500, {
+            'message': f'Error getting company: {str(e)}'
+        })
 
-def create_company(event, user_id, cors_headers):
+def create_company(event, user_id):
     """
     Create a new company and associate it with the user
     """
     try:
-        # Prepare headers with content type
-        headers = cors_headers.copy()
-        headers['Content-Type'] = 'application/json'
-        
         # Parse request body
-        body_str = event.get('body', '{}')
-        body = json.loads(body_str) if body_str else {}
+        body = parse_body(event)
         company_name = body.get('name')
         description = body.get('description', '')
         
         if not company_name:
-            return {
-                'statusCode': 400,
-                'headers': headers,
-                'body': json.dumps({
-                    'message': 'Company name is required'
-                })
-            }
+            return create_response(400, {
+                'message': 'Company name is required'
+            })
         
         # Generate a unique company ID
         company_id = f"comp-{str(uuid.uuid4())}"
@@ -185,198 +215,162 @@ def create_company(event, user_id, cors_headers):
         
         user_company_table.put_item(Item=user_company)
         
-        return {
-            'statusCode': 201,
-            'headers': headers,
-            'body': json.dumps({
-                'message': 'Company created successfully',
-                'company': company
-            })
-        }
+        return create_response(201, {
+            'message': 'Company created successfully',
+            'company': company
+        })
     except Exception as e:
         logger.error(f"Error creating company: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': headers,
-            'body': json.dumps({
-                'message': f'Error creating company: {str(e)}'
-            })
-        }
+        return create_response(500, {
+            'message': f'Error creating company: {str(e)}'
+        })
 
-def update_company(event, user_id, cors_headers):
+def update_company(event, user_id):
     """
     Update company details
     """
     try:
-        # Prepare headers with content type
-        headers = cors_headers.copy()
-        headers['Content-Type'] = 'application/json'
-        
         # Parse request body
-        body_str = event.get('body', '{}')
-        body = json.loads(body_str) if body_str else {}
+        body = parse_body(event)
         company_id = body.get('companyId')
         company_name = body.get('name')
         description = body.get('description')
         
         if not company_id:
-            return {
-                'statusCode': 400,
-                'headers': headers,
-                'body': json.dumps({
-                    'message': 'Company ID is required'
-                })
-            }
-        
-        # Check if the user has admin rights for this company
-        user_company_response = user_company_table.get_item(
-            Key={
-                'userId': user_id,
-                'companyId': company_id
-            }
-        )
-        
-        user_company = user_company_response.get('Item')
-        if not user_company or user_company.get('role') != 'admin':
-            return {
-                'statusCode': 403,
-                'headers': headers,
-                'body': json.dumps({
-                    'message': 'You do not have permission to update this company'
-                })
-            }
+            return create_response(400, {
+                'message': 'Company ID is required'
+            })
         
         # Update company in DynamoDB
+        updated_company = {
+            'companyId': company_id,
+            'updatedAt': datetime.utcnow().isoformat() + 'Z'
+        }
         update_expression = "SET updatedAt = :updatedAt"
         expression_values = {
-            ':updatedAt': datetime.utcnow().isoformat() + 'Z'
+            ':updatedAt': updated_company['updatedAt']
+        }
+        
+        update = {
+            'TableName': company_table.name,
+            'Key': {'companyId': company_id},
+            'ConditionExpression': 'attribute_exists(companyId)'
         }
         
         if company_name:
             update_expression += ", #name = :name"
             expression_values[':name'] = company_name
+            update['ExpressionAttributeNames'] = {'#name': 'name'}
+            updated_company['name'] = company_name
         
         if description is not None:
             update_expression += ", description = :description"
             expression_values[':description'] = description
+            updated_company['description'] = description
         
-        response = company_table.update_item(
-            Key={'companyId': company_id},
-            UpdateExpression=update_expression,
-            ExpressionAttributeValues=expression_values,
-            ExpressionAttributeNames={'#name': 'name'} if company_name else {},
-            ReturnValues="ALL_NEW"
-        )
+        update['UpdateExpression'] = update_expression
+        update['ExpressionAttributeValues'] = expression_values
         
-        updated_company = response.get('Attributes', {})
+        # Check the user has admin rights for this company and update it atomically
+        client = dynamodb.meta.client
+        try:
+            client.transact_write_items(
+                TransactItems=[
+                    admin_condition_check(user_id, company_id),
+                    {'Update': update}
+                ]
+            )
+        except client.exceptions.TransactionCanceledException as e:
+            if failed_condition(e, ADMIN_CHECK_INDEX):
+                return create_response(403, {
+                    'message': 'You do not have permission to update this company'
+                })
+            if failed_condition(e, COMPANY_WRITE_INDEX):
+                return create_response(404, {
+                    'message': 'Company not found'
+                })
+            raise
         
-        return {
-            'statusCode': 200,
-            'headers': headers,
-            'body': json.dumps({
-                'message': 'Company updated successfully',
-                'company': updated_company
-            })
-        }
+        return create_response(200, {
+            'message': 'Company updated successfully',
+            'company': updated_company
+        })
     except Exception as e:
         logger.error(f"Error updating company: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': headers,
-            'body': json.dumps({
-                'message': f'Error updating company: {str(e)}'
-            })
-        }
+        return create_response(500, {
+            'message': f'Error updating company: {str(e)}'
+        })
 
-def delete_company(event, user_id, cors_headers):
+def delete_company(event, user_id):
     """
     Delete a company
     """
     try:
-        # Prepare headers with content type
-        headers = cors_headers.copy()
-        headers['Content-Type'] = 'application/json'
-        
         # Parse request body
-        body_str = event.get('body', '{}')
-        body = json.loads(body_str) if body_str else {}
+        body = parse_body(event)
         company_id = body.get('companyId')
         
         if not company_id:
-            return {
-                'statusCode': 400,
-                'headers': headers,
-                'body': json.dumps({
-                    'message': 'Company ID is required'
-                })
-            }
-        
-        # Check if the user has admin rights for this company
-        user_company_response = user_company_table.get_item(
-            Key={
-                'userId': user_id,
-                'companyId': company_id
-            }
-        )
+            return create_response(400, {
+                'message': 'Company ID is required'
+            })
         
-        user_company = user_company_response.get('Item')
-        if not user_company or user_company.get('role') != 'admin':
-            return {
-                'statusCode': 403,
-                'headers': headers,
-                'body': json.dumps({
+        # Check the user has admin rights for this company and delete it atomically
+        client = dynamodb.meta.client
+        try:
+            client.transact_write_items(
+                TransactItems=[
+                    admin_condition_check(user_id, company_id),
+                    {
+                        'Delete': {
+                            'TableName': company_table.name,
+                            'Key': {'companyId': company_id}
+                        }
+                    }
+                ]
+            )
+        except client.exceptions.TransactionCanceledException as e:
+            # The delete itself is unconditional, so an admin can still clean
+            # up the memberships of a company whose record is already gone
+            if failed_condition(e, ADMIN_CHECK_INDEX):
+                return create_response(403, {
                     'message': 'You do not have permission to delete this company'
                 })
-            }
-        
-        # Query all user-company associations for this company
-        user_company_associations = []
-        response = user_company_table.query(
-            IndexName='CompanyIndex',
-            KeyConditionExpression=boto3.dynamodb.conditions.Key('companyId').eq(company_id)
-        )
-        user_company_associations.extend(response.get('Items', []))
+            raise
         
-        # Continue querying if there are more results (pagination)
-        while 'LastEvaluatedKey' in response:
-            response = user_company_table.query(
+        # Delete all user-company associations for this company, page by page,
+        # so only one page of keys is held at a time. The batch writer sends
+        # the deletes 25 at a time and retries unprocessed items.
+        paginator = client.get_paginator('query')
+        deleted_associations = 0
+        with user_company_table.batch_writer() as batch:
+            for page in paginator.paginate(
+                TableName=user_company_table.name,
                 IndexName='CompanyIndex',
-                KeyConditionExpression=boto3.dynamodb.conditions.Key('companyId').eq(company_id),
-                ExclusiveStartKey=response['LastEvaluatedKey']
-            )
-            user_company_associations.extend(response.get('Items', []))
-        
-        # Delete all user-company associations for this company
-        for association in user_company_associations:
-            user_company_table.delete_item(
-                Key={
-                    'userId': association['userId'],
-                    'companyId': company_id
-                }
-            )
-            logger.info(f"Deleted user-company association for user {association['userId']} and company {company_id}")
+                KeyConditionExpression='companyId = :companyId',
+                ExpressionAttributeValues={':companyId': company_id},
+                ProjectionExpression='userId',
+                PaginationConfig={'PageSize': ASSOCIATION_PAGE_SIZE}
+            ):
+                for association in page.get('Items', []):
+                    batch.delete_item(
+                        Key={
+                            'userId': association['userId'],
+                            'companyId': company_id
+                        }
+                    )
+                    deleted_associations += 1
         
-        # Delete company from DynamoDB
-        company_table.delete_item(
-            Key={'companyId': company_id}
-        )
+        logger.info(f"Deleted {deleted_associations} user-company associations for company {company_id}")
         
         # Note: In a real application, you would also need to:
         # 1. Handle or delete all telemetry data associated with this company's devices
         
-        return {
-            'statusCode': 200,
-            'headers': headers,
-            'body': json.dumps({
-                'message': 'Company deleted successfully'
-            })
-        }
+        return create_response(200, {
+            'message': 'Company deleted successfully'
+        })
     except Exception as e:
         logger.error(f"Error deleting company: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': headers,
-            'body': json.dumps({
-                'message': f'Error deleting company: {str(e)}'
-            })
-        }
+        return create_response(500, {
+            'message': f'Error deleting company: {str(e)}'
+        })
@@ -1,76 +1,160 @@
-import json
+import orjson
 import os
 import uuid
 import boto3
+import time
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from common import parse_body
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Response headers shared by every response
+CORS_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
+    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET,PUT,DELETE'
+}
+
+# CORS preflight response, returned as-is
+OPTIONS_RESPONSE = {
+    'statusCode': 200,
+    'headers': CORS_HEADERS,
+    'body': '{}'
+}
+
+def create_response(status_code, body):
+    """Create a JSON response with the CORS headers"""
+    return {
+        'statusCode': status_code,
+        'headers': CORS_HEADERS,
+        'body': orjson.dumps(body).decode()
+    }
+
+# Connection settings for the DynamoDB and IoT clients. Keep-alive lets a warm
+# container reuse its TLS connections across invocations.
+client_config = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    connect_timeout=1,
+    read_timeout=3,
+    retries={'max_attempts': 5, 'mode': 'adaptive'}
+)
+
 # Initialize DynamoDB client
-dynamodb = boto3.resource('dynamodb')
+dynamodb = boto3.resource('dynamodb', config=client_config)
 device_table = dynamodb.Table(os.environ.get('DEVICE_TABLE'))
 
-# Initialize AWS IoT client
-iot_client = boto3.client('iot')
+# AWS IoT client, created on first use so GET and PUT requests never load it
+iot_client = None
+
+def get_iot_client():
+    """
+    Returns the AWS IoT client, creating it on first use
+    """
+    global iot_client
+    if iot_client is None:
+        iot_client = boto3.client('iot', config=client_config)
+    return iot_client
+
+# Maximum number of certificates cleaned up concurrently when deleting a device
+IOT_WORKERS = 8
+
+# Device attributes returned by GET requests ('name' is a DynamoDB reserved word)
+DEVICE_PROJECTION = 'deviceId, #name, description, companyId, createdBy, createdAt, updatedAt'
+DEVICE_PROJECTION_NAMES = {'#name': 'name'}
+
+# Devices read by GET requests, kept briefly so a device polled repeatedly
+# from the same container is not re-read from DynamoDB every time. Updates
+# and deletes made through this container evict the entry.
+DEVICE_CACHE_SIZE = 256
+DEVICE_CACHE_TTL = 5  # Seconds
+device_cache = OrderedDict()
+
+def get_cached_device(device_id):
+    """
+    Returns the cached device if it hasn't expired
+    """
+    entry = device_cache.get(device_id)
+    if entry is None:
+        return None
+    
+    expires_at, device = entry
+    if time.monotonic() >= expires_at:
+        del device_cache[device_id]
+        return None
+    
+    device_cache.move_to_end(device_id)
+    return device
+
+def cache_device(device_id, device):
+    """
+    Stores a device, evicting the least recently used entry when full
+    """
+    device_cache[device_id] = (time.monotonic() + DEVICE_CACHE_TTL, device)
+    device_cache.move_to_end(device_id)
+    if len(device_cache) > DEVICE_CACHE_SIZE:
+        device_cache.popitem(last=False)
 
 def lambda_handler(event, context):
     """
     Lambda function to manage devices (create, update, delete)
     """
-    logger.info(f"Event: {json.dumps(event)}")
-    
-    # Handle different HTTP methods
+    # Handle OPTIONS request for CORS before doing any other work
     http_method = event.get('httpMethod', '')
-    
     if http_method == 'OPTIONS':
-        # Handle CORS preflight request
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
-                'Access-Control-Allow-Methods': 'OPTIONS,POST,GET,PUT,DELETE'
-            },
-            'body': json.dumps({})
-        }
+        return OPTIONS_RESPONSE
+    
+    logger.debug("Event: %s", event)
     
-    # Extract user information from the request
-    request_context = event.get('requestContext', {})
-    authorizer = request_context.get('authorizer', {})
-    claims = authorizer.get('claims', {})
-    user_id = claims.get('sub', '')
+    # Extract user information from the request; the Cognito authorizer
+    # puts the token claims under requestContext.authorizer.claims
+    try:
+        user_id = event['requestContext']['authorizer']['claims']['sub']
+    except (KeyError, TypeError):
+        user_id = ''
     
     if not user_id:
         logger.error("User ID not found in the request")
-        return {
-            'statusCode': 401,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Unauthorized'})
-        }
+        return create_response(401, {'error': 'Unauthorized'})
     
-    if http_method == 'POST':
-        # Create a new device
-        return register_device(event, user_id)
-    elif http_method == 'GET':
-        # Get device details
-        return get_device(event)
-    elif http_method == 'PUT':
-        # Update device details
-        return update_device(event, user_id)
-    elif http_method == 'DELETE':
-        # Delete a device
-        return delete_device(event, user_id)
-    else:
+    # Handle different HTTP methods
+    handler = METHOD_HANDLERS.get(http_method)
+    if handler is None:
         logger.error(f"Unsupported HTTP method: {http_method}")
-        return {
-            'statusCode': 400,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Unsupported HTTP method: {http_method}'})
-        }
+        return create_response(400, {'error': f'Unsupported HTTP method: {http_method}'})
+    return handler(event, user_id)
+
+def create_thing(device_item):
+    """
+    Register a device as a thing in AWS IoT
+
+    Returns:
+        None on success, otherwise the error message
+    """
+    try:
+        thing_response = get_iot_client().create_thing(
+            thingName=device_item['deviceId'],
+            attributePayload={
+                'attributes': {
+                    'companyId': device_item['companyId'],
+                    'name': device_item['name'],
+                    'description': device_item['description']
+                }
+            }
+        )
+        logger.info(f"Successfully registered device {device_item['deviceId']} in AWS IoT: {thing_response}")
+        return None
+    except ClientError as e:
+        logger.error(f"Error registering device in AWS IoT: {str(e)}")
+        return str(e)
 
 def register_device(event, user_id):
     """
@@ -78,45 +162,20 @@ def register_device(event, user_id):
     """
     try:
         # Parse request body
-        body = json.loads(event.get('body', '{}'))
+        body = parse_body(event)
         
         # Validate required fields
         device_id = body.get('deviceId')
         company_id = body.get('companyId')
         
         if not device_id:
-            return {
-                'statusCode': 400,
-                'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Device ID is required'})
-            }
+            return create_response(400, {'error': 'Device ID is required'})
         
         if not company_id:
-            return {
-                'statusCode': 400,
-                'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Company ID is required'})
-            }
-        
-        # Check if device already exists
-        try:
-            response = device_table.get_item(Key={'deviceId': device_id})
-            if 'Item' in response:
-                return {
-                    'statusCode': 409,
-                    'headers': {'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': f'Device with ID {device_id} already exists'})
-                }
-        except ClientError as e:
-            logger.error(f"Error checking device existence: {str(e)}")
-            return {
-                'statusCode': 500,
-                'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Error checking device existence'})
-            }
+            return create_response(400, {'error': 'Company ID is required'})
         
         # Create device item
-        timestamp = datetime.utcnow().isoformat()
+        timestamp = datetime.now(timezone.utc).isoformat()
         device_item = {
             'deviceId': device_id,
             'companyId': company_id,
@@ -127,54 +186,40 @@ def register_device(event, user_id):
             'updatedAt': timestamp
         }
         
-        # Save to DynamoDB
-        device_table.put_item(Item=device_item)
-        
-        # Register device in AWS IoT
-        iot_registration_success = True
-        iot_error_message = None
+        # Save to DynamoDB, failing if the device already exists
         try:
-            # Create a thing in AWS IoT
-            thing_response = iot_client.create_thing(
-                thingName=device_id,
-                attributePayload={
-                    'attributes': {
-                        'companyId': company_id,
-                        'name': body.get('name', ''),
-                        'description': body.get('description', '')
-                    }
-                }
+            device_table.put_item(
+                Item=device_item,
+                ConditionExpression='attribute_not_exists(deviceId)'
             )
-            logger.info(f"Successfully registered device {device_id} in AWS IoT: {thing_response}")
         except ClientError as e:
-            iot_registration_success = False
-            iot_error_message = str(e)
-            logger.error(f"Error registering device in AWS IoT: {iot_error_message}")
-            # We continue with the operation as the device is already in DynamoDB
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return create_response(409, {'error': f'Device with ID {device_id} already exists'})
+            logger.error(f"Error saving device: {str(e)}")
+            return create_response(500, {'error': 'Error saving device'})
+        
+        # Register the thing only once the device row is written, so a failed
+        # or duplicate registration never creates a thing in AWS IoT
+        iot_error_message = create_thing(device_item)
+        
+        # We continue with the operation as the device is already in DynamoDB
+        iot_registration_success = iot_error_message is None
         
         response_message = 'Device registered successfully'
         if not iot_registration_success:
             response_message += f', but failed to register in AWS IoT: {iot_error_message}'
         
-        return {
-            'statusCode': 201,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'message': response_message,
-                'device': device_item,
-                'iotRegistrationSuccess': iot_registration_success
-            })
-        }
+        return create_response(201, {
+            'message': response_message,
+            'device': device_item,
+            'iotRegistrationSuccess': iot_registration_success
+        })
     
     except Exception as e:
         logger.error(f"Error registering device: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Error registering device: {str(e)}'})
-        }
+        return create_response(500, {'error': f'Error registering device: {str(e)}'})
 
-def get_device(event):
+def get_device(event, user_id):
     """
     Get device details
     """
@@ -184,35 +229,28 @@ def get_device(event):
         device_id = query_params.get('deviceId')
         
         if not device_id:
-            return {
-                'statusCode': 400,
-                'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Device ID is required'})
-            }
+            return create_response(400, {'error': 'Device ID is required'})
         
-        # Get device from DynamoDB
-        response = device_table.get_item(Key={'deviceId': device_id})
-        
-        if 'Item' not in response:
-            return {
-                'statusCode': 404,
-                'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': f'Device with ID {device_id} not found'})
-            }
+        # Get device from the cache or DynamoDB
+        device = get_cached_device(device_id)
+        if device is None:
+            response = device_table.get_item(
+                Key={'deviceId': device_id},
+                ProjectionExpression=DEVICE_PROJECTION,
+                ExpressionAttributeNames=DEVICE_PROJECTION_NAMES
+            )
+            
+            if 'Item' not in response:
+                return create_response(404, {'error': f'Device with ID {device_id} not found'})
+            
+            device = response['Item']
+            cache_device(device_id, device)
         
-        return {
-            'statusCode': 200,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'device': response['Item']})
-        }
+        return create_response(200, {'device': device})
     
     except Exception as e:
         logger.error(f"Error getting device: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Error getting device: {str(e)}'})
-        }
+        return create_response(500, {'error': f'Error getting device: {str(e)}'})
 
 def update_device(event, user_id):
     """
@@ -220,71 +258,137 @@ def update_device(event, user_id):
     """
     try:
         # Parse request body
-        body = json.loads(event.get('body', '{}'))
+        body = parse_body(event)
         
         # Validate required fields
         device_id = body.get('deviceId')
         
         if not device_id:
-            return {
-                'statusCode': 400,
-                'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Device ID is required'})
-            }
-        
-        # Check if device exists
-        response = device_table.get_item(Key={'deviceId': device_id})
-        
-        if 'Item' not in response:
-            return {
-                'statusCode': 404,
-                'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': f'Device with ID {device_id} not found'})
-            }
+            return create_response(400, {'error': 'Device ID is required'})
         
         # Update device item
-        existing_device = response['Item']
-        timestamp = datetime.utcnow().isoformat()
+        timestamp = datetime.now(timezone.utc).isoformat()
         
-        update_expression = "SET updatedAt = :updatedAt"
+        update_clauses = ['updatedAt = :updatedAt']
         expression_attribute_values = {
             ':updatedAt': timestamp
         }
+        expression_attribute_names = {}
         
         # Update fields if provided
         if 'name' in body:
-            update_expression += ", #name = :name"
+            update_clauses.append('#name = :name')
             expression_attribute_values[':name'] = body['name']
+            expression_attribute_names['#name'] = 'name'
         
         if 'description' in body:
-            update_expression += ", description = :description"
+            update_clauses.append('description = :description')
             expression_attribute_values[':description'] = body['description']
         
-        # Update in DynamoDB
-        response = device_table.update_item(
-            Key={'deviceId': device_id},
-            UpdateExpression=update_expression,
-            ExpressionAttributeValues=expression_attribute_values,
-            ExpressionAttributeNames={'#name': 'name'} if 'name' in body else {},
-            ReturnValues="ALL_NEW"
-        )
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'message': 'Device updated successfully',
-                'device': response.get('Attributes', {})
-            })
+        update_kwargs = {
+            'Key': {'deviceId': device_id},
+            'UpdateExpression': 'SET ' + ', '.join(update_clauses),
+            'ConditionExpression': 'attribute_exists(deviceId)',
+            'ExpressionAttributeValues': expression_attribute_values,
+            'ReturnValues': 'UPDATED_NEW'
         }
+        if expression_attribute_names:
+            update_kwargs['ExpressionAttributeNames'] = expression_attribute_names
+        
+        # Update in DynamoDB, failing if the device does not exist
+        try:
+            response = device_table.update_item(**update_kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return create_response(404, {'error': f'Device with ID {device_id} not found'})
+            raise
+        device_cache.pop(device_id, None)
+        
+        # Only the attributes this request set come back from DynamoDB
+        return create_response(200, {
+            'message': 'Device updated successfully',
+            'device': {'deviceId': device_id, **response.get('Attributes', {})}
+        })
     
     except Exception as e:
         logger.error(f"Error updating device: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Error updating device: {str(e)}'})
-        }
+        return create_response(500, {'error': f'Error updating device: {str(e)}'})
+
+def detach_policy(cert_id, principal, policy_name):
+    """
+    Detach a policy from a certificate, logging rather than raising on failure
+    """
+    try:
+        logger.info(f"Detaching policy {policy_name} from certificate {cert_id}")
+        get_iot_client().detach_policy(
+            policyName=policy_name,
+            target=principal
+        )
+    except ClientError as e:
+        logger.warning(f"Error detaching policy {policy_name} from certificate {cert_id}: {str(e)}")
+
+def cleanup_principal(device_id, principal):
+    """
+    Detach a certificate from a device, detach its policies and delete it
+    """
+    try:
+        # Get certificate ID from ARN
+        cert_id = principal.split('/')[-1]
+        
+        # Detach the certificate from the thing
+        logger.info(f"Detaching certificate {cert_id} from device {device_id}")
+        get_iot_client().detach_thing_principal(
+            thingName=device_id,
+            principal=principal
+        )
+        
+        # Find and detach any policies attached to the certificate
+        try:
+            policies_response = get_iot_client().list_attached_policies(
+                target=principal
+            )
+            policies = policies_response.get('policies', [])
+            
+            # Detach the policies concurrently
+            if policies:
+                with ThreadPoolExecutor(max_workers=min(IOT_WORKERS, len(policies))) as executor:
+                    list(executor.map(lambda policy: detach_policy(cert_id, principal, policy.get('policyName')), policies))
+        except ClientError as e:
+            logger.warning(f"Error listing policies of certificate {cert_id}: {str(e)}")
+        
+        # Deactivate the certificate. forceDelete only skips the policy check,
+        # so IoT still refuses to delete a certificate that is ACTIVE.
+        logger.info(f"Deactivating certificate {cert_id}")
+        get_iot_client().update_certificate(
+            certificateId=cert_id,
+            newStatus='INACTIVE'
+        )
+        
+        # Delete the certificate
+        logger.info(f"Deleting certificate {cert_id}")
+        get_iot_client().delete_certificate(
+            certificateId=cert_id,
+            forceDelete=True
+        )
+    except ClientError as e:
+        logger.warning(f"Error processing certificate {principal}: {str(e)}")
+
+def list_device_principals(device_id):
+    """
+    List the principals (certificates) attached to a device's thing
+    """
+    try:
+        paginator = get_iot_client().get_paginator('list_thing_principals')
+        principals = [
+            principal
+            for page in paginator.paginate(thingName=device_id)
+            for principal in page.get('principals', [])
+        ]
+        logger.info(f"Found {len(principals)} principals attached to device {device_id}")
+        return principals
+    except ClientError as e:
+        logger.warning(f"Error listing principals for device {device_id}: {str(e)}")
+        return []
 
 def delete_device(event, user_id):
     """
@@ -296,83 +400,34 @@ def delete_device(event, user_id):
         device_id = query_params.get('deviceId')
         
         if not device_id:
-            return {
-                'statusCode': 400,
-                'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Device ID is required'})
-            }
-        
-        # Check if device exists
-        response = device_table.get_item(Key={'deviceId': device_id})
-        
-        if 'Item' not in response:
-            return {
-                'statusCode': 404,
-                'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': f'Device with ID {device_id} not found'})
-            }
+            return create_response(400, {'error': 'Device ID is required'})
         
-        # Delete from DynamoDB
-        device_table.delete_item(Key={'deviceId': device_id})
+        # Delete from DynamoDB, failing if the device does not exist. The
+        # principals (certificates) attached to the thing are listed at the
+        # same time; nothing in IoT is changed until the delete succeeds.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            principals_future = executor.submit(list_device_principals, device_id)
+            try:
+                device_table.delete_item(
+                    Key={'deviceId': device_id},
+                    ConditionExpression='attribute_exists(deviceId)'
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                    return create_response(404, {'error': f'Device with ID {device_id} not found'})
+                raise
+            device_cache.pop(device_id, None)
+            principals = principals_future.result()
         
         # Delete from AWS IoT
         try:
-            # First, find all principals (certificates) attached to the thing
-            principals = []
-            try:
-                principals_response = iot_client.list_thing_principals(thingName=device_id)
-                principals = principals_response.get('principals', [])
-                logger.info(f"Found {len(principals)} principals attached to device {device_id}")
-            except ClientError as e:
-                logger.warning(f"Error listing principals for device {device_id}: {str(e)}")
-            
-            # Detach and delete each principal (certificate)
-            for principal in principals:
-                try:
-                    # Get certificate ID from ARN
-                    cert_id = principal.split('/')[-1]
-                    
-                    # Detach the certificate from the thing
-                    logger.info(f"Detaching certificate {cert_id} from device {device_id}")
-                    iot_client.detach_thing_principal(
-                        thingName=device_id,
-                        principal=principal
-                    )
-                    
-                    # Find and detach any policies attached to the certificate
-                    try:
-                        policies_response = iot_client.list_attached_policies(
-                            target=principal
-                        )
-                        
-                        for policy in policies_response.get('policies', []):
-                            policy_name = policy.get('policyName')
-                            logger.info(f"Detaching policy {policy_name} from certificate {cert_id}")
-                            iot_client.detach_policy(
-                                policyName=policy_name,
-                                target=principal
-                            )
-                    except ClientError as e:
-                        logger.warning(f"Error detaching policies from certificate {cert_id}: {str(e)}")
-                    
-                    # Deactivate the certificate
-                    logger.info(f"Deactivating certificate {cert_id}")
-                    iot_client.update_certificate(
-                        certificateId=cert_id,
-                        newStatus='INACTIVE'
-                    )
-                    
-                    # Delete the certificate
-                    logger.info(f"Deleting certificate {cert_id}")
-                    iot_client.delete_certificate(
-                        certificateId=cert_id,
-                        forceDelete=True
-                    )
-                except ClientError as e:
-                    logger.warning(f"Error processing certificate {principal}: {str(e)}")
+            # Detach and delete the principals (certificates) concurrently
+            if principals:
+                with ThreadPoolExecutor(max_workers=min(IOT_WORKERS, len(principals))) as executor:
+                    list(executor.map(lambda principal: cleanup_principal(device_id, principal), principals))
             
             # Now delete the thing
-            iot_client.delete_thing(thingName=device_id)
+            get_iot_client().delete_thing(thingName=device_id)
             logger.info(f"Successfully deleted device {device_id} from AWS IoT")
         except ClientError as e:
             # If the thing doesn't exist in IoT, log the error but don't fail the operation
@@ -384,16 +439,16 @@ def delete_device(event, user_id):
                 # We don't return an error here as we've already deleted from DynamoDB
                 # and we want the operation to be considered successful
         
-        return {
-            'statusCode': 200,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'message': 'Device deleted successfully'})
-        }
+        return create_response(200, {'message': 'Device deleted successfully'})
     
     except Exception as e:
         logger.error(f"Error deleting device: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Error deleting device: {str(e)}'})
-        }
+        return create_response(500, {'error': f'Error deleting device: {str(e)}'})
+
+# Handler for each supported HTTP method
+METHOD_HANDLERS = {
+    'POST': register_device,
+    'GET': get_device,
+    'PUT': update_device,
+    'DELETE': delete_device
+}
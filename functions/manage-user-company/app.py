@@ -1,20 +1,40 @@
-import json
+import orjson
 import boto3
 import os
 import logging
 import datetime
-from boto3.dynamodb.conditions import Key, Attr
+import time
+import random
+import threading
+from botocore.config import Config
 from decimal import Decimal
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-# Import auth module from Lambda layer
+# Import the auth and shared helper modules from the Lambda layer
 import auth
+from common import parse_body
 
-# Custom JSON encoder to handle Decimal types
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return float(obj)
-        return super(DecimalEncoder, self).default(obj)
+# orjson hook for the Decimal numbers DynamoDB returns
+def decimal_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+# Response headers shared by every response
+CORS_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+    'Access-Control-Allow-Methods': 'OPTIONS,GET,POST,DELETE'
+}
+
+# CORS preflight response, returned as-is
+OPTIONS_RESPONSE = {
+    'statusCode': 200,
+    'headers': CORS_HEADERS,
+    'body': '{}'
+}
 
 # Set up logging
 logger = logging.getLogger()
@@ -25,9 +45,20 @@ endpoint_url = None
 if 'AWS_SAM_LOCAL' in os.environ or 'LAMBDA_TASK_ROOT' not in os.environ:
     # Local development
     endpoint_url = 'http://localhost:8000'
-    logger.info(f"Using local DynamoDB endpoint: {endpoint_url}")
+    logger.info("Using local DynamoDB endpoint: %s", endpoint_url)
+
+# Connection settings for the DynamoDB and Cognito clients. Keep-alive lets a
+# warm container reuse its TLS connections across invocations, and the pool
+# is larger than USER_LOOKUP_WORKERS so concurrent lookups don't queue.
+client_config = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    connect_timeout=1,
+    read_timeout=3,
+    retries={'max_attempts': 5, 'mode': 'adaptive'}
+)
 
-dynamodb = boto3.resource('dynamodb', endpoint_url=endpoint_url)
+dynamodb = boto3.resource('dynamodb', endpoint_url=endpoint_url, config=client_config)
 user_company_table_name = os.environ.get('USER_COMPANY_TABLE', 'UserCompanyTable')
 company_table_name = os.environ.get('COMPANY_TABLE', 'CompanyTable')
 
@@ -38,18 +69,57 @@ if not company_table_name:
     company_table_name = 'CompanyTable'
     
 # Log table names for debugging
-logger.info(f"USER_COMPANY_TABLE: {user_company_table_name}")
-logger.info(f"COMPANY_TABLE: {company_table_name}")
+logger.info("USER_COMPANY_TABLE: %s", user_company_table_name)
+logger.info("COMPANY_TABLE: %s", company_table_name)
     
 user_company_table = dynamodb.Table(user_company_table_name)
 company_table = dynamodb.Table(company_table_name)
 
-# Initialize Cognito client
-cognito = boto3.client('cognito-idp', endpoint_url=endpoint_url)
+# Only the company attributes the web and mobile apps read are fetched
+# ('name' is a DynamoDB reserved word)
+COMPANY_PROJECTION = 'companyId, #name, description, address, contactEmail, contactPhone'
+COMPANY_PROJECTION_NAMES = {'#name': 'name'}
+
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_SIZE = 100
+BATCH_GET_MAX_ATTEMPTS = 5
+
+# Cognito client, created on first use since only the company members
+# listing and POST need it
+cognito = None
+cognito_lock = threading.Lock()
+
+def get_cognito():
+    """
+    Returns the Cognito client, creating it on first use
+    
+    The lock keeps concurrent user lookups from each building a client.
+    """
+    global cognito
+    if cognito is None:
+        with cognito_lock:
+            if cognito is None:
+                cognito = boto3.client('cognito-idp', endpoint_url=endpoint_url, config=client_config)
+    return cognito
 user_pool_id = os.environ.get('USER_POOL_ID')
 
 # Log user pool ID for debugging
-logger.info(f"USER_POOL_ID: {user_pool_id}")
+logger.info("USER_POOL_ID: %s", user_pool_id)
+
+# Memberships confirmed by user_belongs_to_company, so a user repeatedly
+# querying their own company skips the GetItem. Only positive results are
+# cached, and changes made through this container evict the entry; removals
+# made through other containers take up to MEMBERSHIP_CACHE_TTL to apply.
+MEMBERSHIP_CACHE_SIZE = 1024
+MEMBERSHIP_CACHE_TTL = 60  # Seconds
+membership_cache = OrderedDict()
+
+# Cognito has no batch user lookup, so a company's users are fetched concurrently
+USER_LOOKUP_WORKERS = 10
+USER_LOOKUP_MAX_ATTEMPTS = 5
+
+# Largest list of assignments a single POST may carry
+MAX_ASSIGNMENTS_PER_REQUEST = 100
 
 def lambda_handler(event, context):
     """
@@ -60,27 +130,18 @@ def lambda_handler(event, context):
     - POST: Assign a user to a company
     - DELETE: Remove a user from a company
     """
+    # Handle OPTIONS request for CORS before doing any other work
+    if event.get('httpMethod') == 'OPTIONS':
+        return OPTIONS_RESPONSE
+    
     try:
         # Log the incoming event for debugging
-        logger.info(f"Received event: {event}")
+        logger.debug("Received event: %s", event)
         
-        # Check if this is an OPTIONS request (CORS preflight)
-        if event.get('httpMethod') == 'OPTIONS':
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'OPTIONS,GET,POST,DELETE'
-                },
-                'body': json.dumps({})
-            }
-            
         # Validate JWT token
         try:
             claims = auth.require_auth(event)
-            logger.info(f"Authenticated user: {claims.get('username') if claims else 'None'}")
+            logger.info("Authenticated user: %s", claims.get('username') or claims.get('cognito:username'))
             
             # Check if user is an admin (for operations that require admin privileges)
             # This is a simple example - you might want to use Cognito groups for a more robust approach
@@ -88,19 +149,7 @@ def lambda_handler(event, context):
             
         except Exception as e:
             logger.error(f"Authentication error: {str(e)}")
-            return {
-                'statusCode': 401,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'OPTIONS,GET,POST,DELETE'
-                },
-                'body': json.dumps({
-                    'error': 'Unauthorized',
-                    'message': str(e)
-                }, cls=DecimalEncoder)
-            }
+            return create_error_response(401, 'Unauthorized', str(e))
         
         # Handle different HTTP methods
         http_method = event.get('httpMethod')
@@ -112,37 +161,13 @@ def lambda_handler(event, context):
         elif http_method == 'DELETE':
             return handle_delete_request(event, claims, is_admin)
         else:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'OPTIONS,GET,POST,DELETE'
-                },
-                'body': json.dumps({
-                    'error': 'Invalid HTTP method',
-                    'message': f'Method {http_method} not supported'
-                })
-            }
+            return create_error_response(400, 'Invalid HTTP method', f'Method {http_method} not supported')
             
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                'Access-Control-Allow-Methods': 'OPTIONS,GET,POST,DELETE'
-            },
-            'body': json.dumps({
-                'error': 'Internal server error',
-                'message': str(e)
-            }, cls=DecimalEncoder)
-        }
+        return create_error_response(500, 'Internal server error', str(e))
 
 def handle_get_request(event, claims, is_admin):
     """
@@ -166,20 +191,14 @@ def handle_get_request(event, claims, is_admin):
             return create_error_response(403, 'Forbidden', 'You can only query your own user-company relationships')
         
         # Query the UserCompany table
-        response = user_company_table.query(
-            KeyConditionExpression=Key('userId').eq(user_id)
+        memberships = query_memberships(
+            KeyConditionExpression='userId = :userId',
+            ExpressionAttributeValues={':userId': user_id},
+            ProjectionExpression='companyId'
         )
         
-        # Get company details for each company ID
-        companies = []
-        for item in response.get('Items', []):
-            company_id = item.get('companyId')
-            company_response = company_table.get_item(
-                Key={'companyId': company_id}
-            )
-            company = company_response.get('Item')
-            if company:
-                companies.append(company)
+        # Get company details for all company IDs in batches
+        companies = get_companies([item.get('companyId') for item in memberships])
         
         return create_success_response({
             'userId': user_id,
@@ -195,35 +214,19 @@ def handle_get_request(event, claims, is_admin):
             return create_error_response(403, 'Forbidden', 'You can only query companies you belong to')
         
         # Query the UserCompany table using the GSI
-        response = user_company_table.query(
-            IndexName="CompanyIndex",
-            KeyConditionExpression=Key('companyId').eq(company_id)
+        items = query_memberships(
+            IndexName='CompanyIndex',
+            KeyConditionExpression='companyId = :companyId',
+            ExpressionAttributeValues={':companyId': company_id},
+            ProjectionExpression='userId, #role',
+            ExpressionAttributeNames={'#role': 'role'}
         )
         
         # Get user details from Cognito for each user ID
         users = []
-        for item in response.get('Items', []):
-            user_id = item.get('userId')
-            try:
-                # Get user details from Cognito
-                user_response = cognito.admin_get_user(
-                    UserPoolId=user_pool_id,
-                    Username=user_id
-                )
-                
-                # Extract user attributes
-                user_attributes = {}
-                for attr in user_response.get('UserAttributes', []):
-                    user_attributes[attr['Name']] = attr['Value']
-                
-                users.append({
-                    'userId': user_id,
-                    'email': user_attributes.get('email'),
-                    'name': user_attributes.get('name'),
-                    'role': item.get('role', 'user')  # Role in the company
-                })
-            except Exception as e:
-                logger.error(f"Error getting user {user_id}: {str(e)}")
+        if items:
+            with ThreadPoolExecutor(max_workers=min(USER_LOOKUP_WORKERS, len(items))) as executor:
+                users = [user for user in executor.map(get_company_user, items) if user]
         
         return create_success_response({
             'companyId': company_id,
@@ -231,20 +234,14 @@ def handle_get_request(event, claims, is_admin):
         })
     else:
         # If no specific query parameters, return the companies for the authenticated user
-        response = user_company_table.query(
-            KeyConditionExpression=Key('userId').eq(authenticated_user_id)
+        memberships = query_memberships(
+            KeyConditionExpression='userId = :userId',
+            ExpressionAttributeValues={':userId': authenticated_user_id},
+            ProjectionExpression='companyId'
         )
         
-        # Get company details for each company ID
-        companies = []
-        for item in response.get('Items', []):
-            company_id = item.get('companyId')
-            company_response = company_table.get_item(
-                Key={'companyId': company_id}
-            )
-            company = company_response.get('Item')
-            if company:
-                companies.append(company)
+        # Get company details for all company IDs in batches
+        companies = get_companies([item.get('companyId') for item in memberships])
         
         return create_success_response({
             'userId': authenticated_user_id,
@@ -261,10 +258,17 @@ def handle_post_request(event, claims, is_admin):
         "companyId": "company-id",
         "role": "user|admin"  # Role within the company
     }
+    
+    A list of such objects assigns several users in one request.
     """
     try:
         # Parse request body
-        body = json.loads(event.get('body', '{}'))
+        body = parse_body(event)
+        
+        if isinstance(body, list):
+            if not is_admin:
+                return create_error_response(403, 'Forbidden', 'Only admins can assign users to companies')
+            return assign_users(body, claims)
         
         # Extract parameters
         user_id = body.get('userId')
@@ -278,26 +282,30 @@ def handle_post_request(event, claims, is_admin):
         if not is_admin:
             return create_error_response(403, 'Forbidden', 'Only admins can assign users to companies')
         
-        # Verify the company exists
-        company_response = company_table.get_item(
-            Key={'companyId': company_id}
-        )
-        
-        if not company_response.get('Item'):
-            return create_error_response(404, 'Not Found', f'Company with ID {company_id} not found')
-        
-        # Verify the user exists in Cognito
-        try:
-            cognito.admin_get_user(
+        # Verify the company exists while the user is looked up in Cognito
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            user_future = executor.submit(
+                get_cognito().admin_get_user,
                 UserPoolId=user_pool_id,
                 Username=user_id
             )
-        except Exception as e:
-            logger.error(f"Error verifying user: {str(e)}")
-            return create_error_response(404, 'Not Found', f'User with ID {user_id} not found')
+            
+            company_response = company_table.get_item(
+                Key={'companyId': company_id}
+            )
+            
+            if not company_response.get('Item'):
+                return create_error_response(404, 'Not Found', f'Company with ID {company_id} not found')
+            
+            # Verify the user exists in Cognito
+            try:
+                user_future.result()
+            except Exception as e:
+                logger.error(f"Error verifying user: {str(e)}")
+                return create_error_response(404, 'Not Found', f'User with ID {user_id} not found')
         
         # Create the user-company relationship
-        timestamp = datetime.datetime.now().isoformat()
+        timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
         user_company_table.put_item(
             Item={
                 'userId': user_id,
@@ -308,6 +316,7 @@ def handle_post_request(event, claims, is_admin):
                 'updatedAt': timestamp
             }
         )
+        membership_cache.pop((user_id, company_id), None)
         
         return create_success_response({
             'message': f'User {user_id} assigned to company {company_id} with role {role}',
@@ -316,9 +325,72 @@ def handle_post_request(event, claims, is_admin):
             'role': role
         })
         
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         return create_error_response(400, 'Bad Request', 'Invalid JSON in request body')
 
+def assign_users(assignments, claims):
+    """
+    Assign several users to companies in one request
+    
+    Each assignment is validated like a single POST. The valid ones are
+    written with BatchWriteItem; the others are returned with the reason.
+    """
+    if not assignments or len(assignments) > MAX_ASSIGNMENTS_PER_REQUEST:
+        return create_error_response(400, 'Bad Request', f'Provide between 1 and {MAX_ASSIGNMENTS_PER_REQUEST} assignments')
+    
+    failed = []
+    pending = []
+    for assignment in assignments:
+        if not isinstance(assignment, dict) or not assignment.get('userId') or not assignment.get('companyId'):
+            failed.append({'assignment': assignment, 'error': 'Missing required parameters: userId and companyId'})
+        elif not isinstance(assignment['userId'], str) or not isinstance(assignment['companyId'], str):
+            # Other types can't be used as lookup or table keys
+            failed.append({'assignment': assignment, 'error': 'userId and companyId must be strings'})
+        else:
+            pending.append(assignment)
+    
+    # Look up the users in Cognito while the companies are fetched
+    user_ids = list(dict.fromkeys(assignment['userId'] for assignment in pending))
+    with ThreadPoolExecutor(max_workers=USER_LOOKUP_WORKERS) as executor:
+        users = executor.map(get_company_user, [{'userId': user_id} for user_id in user_ids])
+        existing_companies = {company['companyId'] for company in get_companies([assignment['companyId'] for assignment in pending])}
+        existing_users = {user['userId'] for user in users if user}
+    
+    # Create the user-company relationships
+    timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    assigned = []
+    with user_company_table.batch_writer(overwrite_by_pkeys=['userId', 'companyId']) as batch:
+        for assignment in pending:
+            user_id = assignment['userId']
+            company_id = assignment['companyId']
+            role = assignment.get('role', 'user')
+            
+            if company_id not in existing_companies:
+                failed.append({'assignment': assignment, 'error': f'Company with ID {company_id} not found'})
+                continue
+            if user_id not in existing_users:
+                failed.append({'assignment': assignment, 'error': f'User with ID {user_id} not found'})
+                continue
+            
+            batch.put_item(
+                Item={
+                    'userId': user_id,
+                    'companyId': company_id,
+                    'role': role,
+                    'createdBy': claims.get('sub'),
+                    'createdAt': timestamp,
+                    'updatedAt': timestamp
+                }
+            )
+            membership_cache.pop((user_id, company_id), None)
+            assigned.append({'userId': user_id, 'companyId': company_id, 'role': role})
+    
+    return create_success_response({
+        'message': f'Assigned {len(assigned)} of {len(assignments)} users to companies',
+        'assigned': assigned,
+        'failed': failed
+    })
+
 def handle_delete_request(event, claims, is_admin):
     """
     Handle DELETE requests to remove user-company relationships
@@ -347,6 +419,7 @@ def handle_delete_request(event, claims, is_admin):
             'companyId': company_id
         }
     )
+    membership_cache.pop((user_id, company_id), None)
     
     return create_success_response({
         'message': f'User {user_id} removed from company {company_id}',
@@ -354,6 +427,86 @@ def handle_delete_request(event, claims, is_admin):
         'companyId': company_id
     })
 
+def query_memberships(**kwargs):
+    """
+    Query the UserCompany table, following LastEvaluatedKey across all pages
+    """
+    paginator = dynamodb.meta.client.get_paginator('query')
+    items = []
+    for page in paginator.paginate(TableName=user_company_table_name, **kwargs):
+        items.extend(page.get('Items', []))
+    return items
+
+def get_company_user(item):
+    """
+    Get a company member's details from Cognito, or None if the lookup fails
+    
+    Throttled lookups are retried with jittered backoff.
+    """
+    user_id = item.get('userId')
+    try:
+        cognito = get_cognito()
+        for attempt in range(USER_LOOKUP_MAX_ATTEMPTS):
+            try:
+                user_response = cognito.admin_get_user(
+                    UserPoolId=user_pool_id,
+                    Username=user_id
+                )
+                break
+            except cognito.exceptions.TooManyRequestsException:
+                if attempt == USER_LOOKUP_MAX_ATTEMPTS - 1:
+                    raise
+                time.sleep(random.uniform(0, 0.2 * (2 ** attempt)))
+        
+        # Extract user attributes
+        user_attributes = {}
+        for attr in user_response.get('UserAttributes', []):
+            user_attributes[attr['Name']] = attr['Value']
+        
+        return {
+            'userId': user_id,
+            'email': user_attributes.get('email'),
+            'name': user_attributes.get('name'),
+            'role': item.get('role', 'user')  # Role in the company
+        }
+    except Exception as e:
+        logger.error(f"Error getting user {user_id}: {str(e)}")
+        return None
+
+def get_companies(company_ids):
+    """
+    Fetch companies with BatchGetItem, in the order of company_ids
+    
+    Companies that don't exist are left out.
+    """
+    companies_by_id = {}
+    # BatchGetItem rejects duplicate keys
+    keys = [{'companyId': company_id} for company_id in dict.fromkeys(company_ids)]
+    
+    for i in range(0, len(keys), BATCH_GET_SIZE):
+        request_items = {
+            company_table_name: {
+                'Keys': keys[i:i + BATCH_GET_SIZE],
+                'ProjectionExpression': COMPANY_PROJECTION,
+                'ExpressionAttributeNames': COMPANY_PROJECTION_NAMES
+            }
+        }
+        
+        for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            for company in response.get('Responses', {}).get(company_table_name, []):
+                companies_by_id[company['companyId']] = company
+            request_items = response.get('UnprocessedKeys')
+            if not request_items:
+                break
+            if attempt < BATCH_GET_MAX_ATTEMPTS - 1:
+                # Back off before retrying throttled keys
+                time.sleep(min(0.05 * 2 ** attempt, 1))
+        else:
+            logger.warning(f"Could not fetch {len(request_items[company_table_name]['Keys'])} companies after {BATCH_GET_MAX_ATTEMPTS} attempts")
+    
+    return [companies_by_id[company_id] for company_id in company_ids if company_id in companies_by_id]
+
 def is_admin_user(claims):
     """
     Check if the user has admin privileges
@@ -362,10 +515,19 @@ def is_admin_user(claims):
     """
     # You could check for a specific role claim or group membership
     # For now, we'll use a simple approach with a custom claim
-    return claims.get('cognito:groups') and 'admin' in claims.get('cognito:groups')
+    groups = claims.get('cognito:groups') or ()
+    return 'admin' in groups
 
 def user_belongs_to_company(user_id, company_id):
     """Check if a user belongs to a company"""
+    cache_key = (user_id, company_id)
+    expires_at = membership_cache.get(cache_key)
+    if expires_at is not None:
+        if time.monotonic() < expires_at:
+            membership_cache.move_to_end(cache_key)
+            return True
+        del membership_cache[cache_key]
+    
     response = user_company_table.get_item(
         Key={
             'userId': user_id,
@@ -373,33 +535,29 @@ def user_belongs_to_company(user_id, company_id):
         }
     )
     
-    return 'Item' in response
+    if 'Item' not in response:
+        return False
+    
+    membership_cache[cache_key] = time.monotonic() + MEMBERSHIP_CACHE_TTL
+    if len(membership_cache) > MEMBERSHIP_CACHE_SIZE:
+        membership_cache.popitem(last=False)
+    return True
 
 def create_success_response(data):
     """Create a standardized success response"""
     return {
         'statusCode': 200,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-            'Access-Control-Allow-Methods': 'OPTIONS,GET,POST,DELETE'
-        },
-        'body': json.dumps(data, cls=DecimalEncoder)
+        'headers': CORS_HEADERS,
+        'body': orjson.dumps(data, default=decimal_default).decode()
     }
 
 def create_error_response(status_code, error, message):
     """Create a standardized error response"""
     return {
         'statusCode': status_code,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-            'Access-Control-Allow-Methods': 'OPTIONS,GET,POST,DELETE'
-        },
-        'body': json.dumps({
+        'headers': CORS_HEADERS,
+        'body': orjson.dumps({
             'error': error,
             'message': message
-        }, cls=DecimalEncoder)
+        }).decode()
     }
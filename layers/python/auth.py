@@ -1,10 +1,11 @@
 import os
 import json
 import logging
-import base64
-import urllib.request
-from jose import jwk, jwt
-from jose.utils import base64url_decode
+import time
+import threading
+from collections import OrderedDict
+import jwt
+from jwt.algorithms import RSAAlgorithm
 
 # Set up logging
 logger = logging.getLogger()
@@ -15,13 +16,131 @@ USER_POOL_ID = os.environ.get('USER_POOL_ID')
 USER_POOL_CLIENT_ID = os.environ.get('USER_POOL_CLIENT_ID')
 AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
 
+# Cognito JWKS. The keys are bundled with the layer by scripts/fetch_jwks.py
+# at build time; the network is only used when a token's kid is unknown.
+ISSUER = f'https://cognito-idp.{AWS_REGION}.amazonaws.com/{USER_POOL_ID}'
+JWKS_URL = f'{ISSUER}/.well-known/jwks.json'
+JWKS_FILE = os.path.join(os.path.dirname(__file__), 'jwks.json')
+JWKS_REFRESH_INTERVAL = 60  # Minimum seconds between network fetches
+
+def load_bundled_keys():
+    """
+    Loads the JWKS bundled with the layer
+    
+    Returns:
+        list: The public keys, or an empty list if no JWKS was bundled
+    """
+    try:
+        with open(JWKS_FILE) as f:
+            return json.load(f)['keys']
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f'Could not load bundled JWKS: {str(e)}')
+        return []
+
+def fetch_public_keys():
+    """
+    Fetches the public keys from the Cognito JWKS endpoint
+    
+    Returns:
+        list: The public keys
+    """
+    # Imported here as the network is only needed when the bundle misses
+    import urllib.request
+    
+    with urllib.request.urlopen(JWKS_URL, timeout=5) as f:
+        response = f.read()
+    return json.loads(response.decode('utf-8'))['keys']
+
+def index_public_keys(keys):
+    """
+    Builds the kid -> RSA public key index for a JWKS
+    
+    Args:
+        keys (list): The JWKS keys
+        
+    Returns:
+        dict: cryptography RSAPublicKey objects keyed by kid
+    """
+    return {k['kid']: RSAAlgorithm.from_jwk(json.dumps(k)) for k in keys}
+
+public_keys = index_public_keys(load_bundled_keys())
+last_keys_fetch = 0.0
+keys_refresh_lock = threading.Lock()
+
+def find_public_key(kid):
+    """
+    Finds the public key for a key id, refetching the JWKS on a miss
+    
+    Args:
+        kid (str): The key id from the token header
+        
+    Returns:
+        The constructed public key, or None if the key is unknown
+    """
+    global public_keys, last_keys_fetch
+    
+    public_key = public_keys.get(kid)
+    if public_key is not None:
+        return public_key
+    
+    # Unknown kid: the bundle is missing or the keys rotated. Rate-limit
+    # the refetch so garbage tokens can't hammer the Cognito endpoint, and
+    # let only one thread fetch while the others wait for its result.
+    with keys_refresh_lock:
+        public_key = public_keys.get(kid)
+        if public_key is not None:
+            return public_key
+        
+        now = time.time()
+        if now - last_keys_fetch < JWKS_REFRESH_INTERVAL:
+            return None
+        last_keys_fetch = now
+        public_keys = index_public_keys(fetch_public_keys())
+    
+    return public_keys.get(kid)
+
+# Verified claims keyed by the token's signature segment, so warm
+# invocations that reuse a token skip the signature check. The signature
+# is unique per token, so it makes a short key that needs no hashing or
+# parsing; hits still compare the whole token. Entries expire with the token.
+CLAIMS_CACHE_SIZE = 1024
+CLAIMS_CACHE_EXPIRY_MARGIN = 5  # Seconds before 'exp' to stop trusting an entry
+claims_cache = OrderedDict()
+
+def get_cached_claims(cache_key, token):
+    """
+    Returns the cached claims for a token if they haven't expired
+    """
+    entry = claims_cache.get(cache_key)
+    if entry is None:
+        return None
+    
+    expires_at, cached_token, claims = entry
+    if cached_token != token:
+        return None
+    if time.time() >= expires_at:
+        del claims_cache[cache_key]
+        return None
+    
+    claims_cache.move_to_end(cache_key)
+    return claims
+
+def cache_claims(cache_key, token, claims):
+    """
+    Stores verified claims, evicting the least recently used entry when full
+    """
+    claims_cache[cache_key] = (claims['exp'] - CLAIMS_CACHE_EXPIRY_MARGIN, token, claims)
+    claims_cache.move_to_end(cache_key)
+    if len(claims_cache) > CLAIMS_CACHE_SIZE:
+        claims_cache.popitem(last=False)
+
 # JWT token validation
 def validate_token(token):
     """
     Validates a JWT token from AWS Cognito
     
     Args:
-        token (str): The JWT token to validate
+        token (bytes): The JWT token to validate (str is also accepted)
         
     Returns:
         dict: The claims from the token if valid
@@ -30,42 +149,42 @@ def validate_token(token):
         Exception: If the token is invalid
     """
     try:
+        # JWTs are ASCII; encode once here rather than in every PyJWT call
+        if isinstance(token, str):
+            token = token.encode('ascii')
+        
+        cache_key = token.rpartition(b'.')[2]
+        claims = get_cached_claims(cache_key, token)
+        if claims is not None:
+            return claims
+        
+        # Reject expired and foreign tokens from their unverified claims
+        # before paying for the RSA verify (or a JWKS fetch for an unknown
+        # kid). Passing these checks proves nothing; jwt.decode below still
+        # verifies the signature and re-checks both claims.
+        unverified_claims = jwt.decode(token, options={'verify_signature': False})
+        if unverified_claims.get('iss') != ISSUER:
+            raise Exception('Invalid issuer')
+        if unverified_claims.get('exp', 0) <= time.time():
+            raise Exception('Token has expired')
+        
         # Get the key id from the token header
-        token_sections = token.split('.')
-        if len(token_sections) < 2:
-            raise Exception('Token is invalid')
-            
-        header = json.loads(base64.b64decode(token_sections[0] + '==').decode('utf-8'))
-        kid = header['kid']
-        
-        # Get the public keys from Cognito
-        keys_url = f'https://cognito-idp.{AWS_REGION}.amazonaws.com/{USER_POOL_ID}/.well-known/jwks.json'
-        with urllib.request.urlopen(keys_url) as f:
-            response = f.read()
-        keys = json.loads(response.decode('utf-8'))['keys']
-        
-        # Find the key matching the kid from the token
-        key = None
-        for k in keys:
-            if k['kid'] == kid:
-                key = k
-                break
-                
-        if not key:
-            raise Exception('Public key not found')
-            
-        # Get the public key
-        public_key = jwk.construct(key)
+        kid = jwt.get_unverified_header(token)['kid']
         
-        # Verify the signature
-        message = token_sections[0].encode('utf-8') + '.'.encode('utf-8') + token_sections[1].encode('utf-8')
-        signature = base64url_decode(token_sections[2].encode('utf-8'))
+        # Get the public key matching the kid from the token
+        public_key = find_public_key(kid)
+        if public_key is None:
+            raise Exception('Public key not found')
         
-        if not public_key.verify(message, signature):
-            raise Exception('Signature verification failed')
-            
-        # Verify the claims
-        claims = jwt.get_unverified_claims(token)
+        # Verify the signature, expiration and issuer. The audience is checked
+        # below because access tokens carry it in 'client_id' instead of 'aud'.
+        claims = jwt.decode(
+            token,
+            key=public_key,
+            algorithms=['RS256'],
+            issuer=ISSUER,
+            options={'verify_aud': False, 'require': ['exp', 'iss']}
+        )
         
         # Verify the token use (accept both access and id tokens)
         if claims['token_use'] not in ['access', 'id']:
@@ -81,11 +200,7 @@ def validate_token(token):
         if not client_id or (client_id != USER_POOL_CLIENT_ID):
             raise Exception('Token was not issued for this client')
             
-        # Verify the expiration
-        import time
-        if time.time() > claims['exp']:
-            raise Exception('Token has expired')
-            
+        cache_claims(cache_key, token, claims)
         return claims
         
     except Exception as e:
@@ -100,24 +215,29 @@ def get_token_from_header(event):
         event (dict): The Lambda event
         
     Returns:
-        str: The JWT token
+        bytes: The JWT token
         
     Raises:
         Exception: If the token is not found
     """
     try:
-        auth_header = event['headers'].get('Authorization')
+        # Header names are case-insensitive. Try the two casings API Gateway
+        # delivers before scanning every header for any other casing.
+        headers = event.get('headers') or {}
+        auth_header = headers.get('Authorization') or headers.get('authorization')
         if not auth_header:
-            auth_header = event['headers'].get('authorization')
-            
+            auth_header = next((v for k, v in headers.items() if k.lower() == 'authorization'), None)
         if not auth_header:
             raise Exception('Authorization header is missing')
             
-        token_parts = auth_header.split()
-        if len(token_parts) != 2 or token_parts[0].lower() != 'bearer':
+        # Slice the token off the 'Bearer ' prefix without splitting the header
+        if auth_header[:7].lower() != 'bearer ':
+            raise Exception('Authorization header is malformed')
+        token = auth_header[7:].strip()
+        if not token or ' ' in token:
             raise Exception('Authorization header is malformed')
             
-        return token_parts[1]
+        return token.encode('ascii')
         
     except Exception as e:
         logger.error(f'Error extracting token: {str(e)}')
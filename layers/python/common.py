@@ -0,0 +1,45 @@
+import base64
+import orjson
+
+# Helpers shared by the Campo Vision Lambda functions. orjson is not part of
+# the layer; every function that uses it bundles it in its own requirements.
+
+def parse_body(event):
+    """Parse the JSON request body, treating a missing body as empty"""
+    body = event.get('body')
+    if not body:
+        return {}
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body)
+    return orjson.loads(body)
+
+def from_attribute_value(value):
+    """
+    Converts a DynamoDB AttributeValue to a JSON-serializable value
+
+    Numbers are returned as floats, matching what the frontend expects.
+    """
+    value_type, data = next(iter(value.items()))
+    if value_type == 'S':
+        return data
+    if value_type == 'N':
+        return float(data)
+    if value_type == 'BOOL':
+        return data
+    if value_type == 'NULL':
+        return None
+    if value_type == 'M':
+        return {k: from_attribute_value(v) for k, v in data.items()}
+    if value_type == 'L':
+        return [from_attribute_value(v) for v in data]
+    if value_type == 'NS':
+        return [float(n) for n in data]
+    if value_type == 'SS':
+        return list(data)
+    raise TypeError(f'Unsupported DynamoDB attribute type: {value_type}')
+
+def from_item(item):
+    """
+    Converts a DynamoDB item to a JSON-serializable dict
+    """
+    return {k: from_attribute_value(v) for k, v in item.items()}
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Script to backfill the latest telemetry table of the Campo Vision project.
+
+The list-devices function reads each device's last reading from the latest
+telemetry table, which ingest-telemetry and the IoT rule keep up to date.
+Devices that last reported before that table existed have no snapshot, so
+this script copies the newest telemetry record of every device into it once.
+
+Run it after the first deploy that adds the latest telemetry table. It is
+safe to run again: a snapshot is only written when the table holds no newer
+reading for the device.
+
+Usage:
+    python backfill_latest_telemetry.py --device-table TABLE --telemetry-table TABLE --latest-table TABLE
+    python backfill_latest_telemetry.py [--profile PROFILE] [--region REGION] [--workers N]
+
+Options:
+    --profile PROFILE          AWS profile to use
+    --region REGION            AWS region to use (default: us-east-1)
+    --device-table TABLE       Device table name (default: $DEVICE_TABLE or DeviceTable)
+    --telemetry-table TABLE    Telemetry table name (default: $TELEMETRY_TABLE or TelemetryTable)
+    --latest-table TABLE       Latest telemetry table name
+                               (default: $LATEST_TELEMETRY_TABLE or LatestTelemetryTable)
+    --workers N                Number of devices backfilled concurrently (default: 16)
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+DEFAULT_WORKERS = 16
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Backfill the latest telemetry table.')
+    parser.add_argument('--profile', help='AWS profile to use')
+    parser.add_argument('--region', default='us-east-1', help='AWS region to use')
+    parser.add_argument('--device-table', default=os.environ.get('DEVICE_TABLE') or 'DeviceTable',
+                        help='Device table name')
+    parser.add_argument('--telemetry-table', default=os.environ.get('TELEMETRY_TABLE') or 'TelemetryTable',
+                        help='Telemetry table name')
+    parser.add_argument('--latest-table', default=os.environ.get('LATEST_TELEMETRY_TABLE') or 'LatestTelemetryTable',
+                        help='Latest telemetry table name')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='Number of devices backfilled concurrently')
+    return parser.parse_args()
+
+
+def list_device_ids(dynamodb_client, device_table):
+    """
+    List the IDs of all registered devices.
+
+    Args:
+        dynamodb_client: DynamoDB client
+        device_table: Name of the device table
+
+    Returns:
+        List of device IDs
+    """
+    paginator = dynamodb_client.get_paginator('scan')
+    return [
+        item['deviceId']['S']
+        for page in paginator.paginate(TableName=device_table, ProjectionExpression='deviceId')
+        for item in page.get('Items', [])
+    ]
+
+
+def backfill_device(dynamodb_client, telemetry_table, latest_table, device_id):
+    """
+    Copy the newest telemetry record of a device into the latest telemetry table.
+
+    Args:
+        dynamodb_client: DynamoDB client
+        telemetry_table: Name of the telemetry table
+        latest_table: Name of the latest telemetry table
+        device_id: ID of the device
+
+    Returns:
+        'written', 'current' if the table already holds this or a newer
+        reading, or 'no telemetry'
+    """
+    response = dynamodb_client.query(
+        TableName=telemetry_table,
+        KeyConditionExpression='deviceId = :deviceId',
+        ExpressionAttributeValues={':deviceId': {'S': device_id}},
+        ScanIndexForward=False,  # Newest first
+        Limit=1
+    )
+    items = response.get('Items', [])
+    if not items:
+        return 'no telemetry'
+
+    item = items[0]
+    try:
+        # Same condition as ingest-telemetry, so a reading stored while the
+        # backfill runs is never replaced by an older one
+        dynamodb_client.put_item(
+            TableName=latest_table,
+            Item=item,
+            ConditionExpression='attribute_not_exists(deviceId) OR #ts < :ts',
+            ExpressionAttributeNames={'#ts': 'timestamp'},
+            ExpressionAttributeValues={':ts': item['timestamp']}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return 'current'
+        raise
+    return 'written'
+
+
+def main():
+    """Main function."""
+    args = parse_args()
+
+    # Create a session with the specified profile and region
+    session_kwargs = {'region_name': args.region}
+    if args.profile:
+        session_kwargs['profile_name'] = args.profile
+
+    session = boto3.Session(**session_kwargs)
+    client_config = Config(
+        max_pool_connections=max(args.workers, 10),
+        retries={'max_attempts': 10, 'mode': 'adaptive'}
+    )
+    dynamodb_client = session.client('dynamodb', config=client_config)
+
+    print(f"Listing devices in {args.device_table}...")
+    device_ids = list_device_ids(dynamodb_client, args.device_table)
+    if not device_ids:
+        print("No devices found")
+        sys.exit(0)
+
+    print(f"Backfilling {args.latest_table} for {len(device_ids)} devices...")
+
+    def run(device_id):
+        try:
+            return backfill_device(dynamodb_client, args.telemetry_table, args.latest_table, device_id)
+        except (BotoCoreError, ClientError) as e:
+            print(f"Error backfilling device {device_id}: {e}")
+            return 'failed'
+
+    with ThreadPoolExecutor(max_workers=min(args.workers, len(device_ids))) as executor:
+        results = list(executor.map(run, device_ids))
+
+    for result in ('written', 'current', 'no telemetry', 'failed'):
+        print(f"  {result}: {results.count(result)}")
+
+    if 'failed' in results:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
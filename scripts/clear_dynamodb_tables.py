@@ -5,26 +5,51 @@ Script to clear all data from DynamoDB tables in the Campo Vision project.
 This script will:
 1. List all available DynamoDB tables in your AWS account
 2. Allow you to select which tables to clear
-3. Remove all items from the selected tables
+3. Remove all items from the selected tables, either by deleting every item
+   or, with --recreate, by dropping and re-creating each table
 
 Usage:
     python clear_dynamodb_tables.py [--profile PROFILE] [--region REGION] [--list-only]
     python clear_dynamodb_tables.py [--profile PROFILE] [--region REGION] --tables TABLE1 TABLE2
+    python clear_dynamodb_tables.py [--scan-segments N] [--refresh] [--recreate]
 
 Options:
     --profile PROFILE    AWS profile to use
     --region REGION      AWS region to use (default: us-east-1)
     --list-only          Only list available tables without clearing any data
     --tables TABLE1 ...  Specific tables to clear (space-separated)
+    --scan-segments N    Number of parallel scan segments per table (default: 4)
+    --refresh            Ignore the cached table list and fetch it again
+    --recreate           Drop and re-create tables instead of deleting every item
 """
 
 import argparse
+import json
 import boto3
 import time
 import sys
 import re
+import queue
+import threading
+from pathlib import Path
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+DELETE_WORKERS = 10
+MAX_IN_FLIGHT_BATCHES = DELETE_WORKERS * 2
+DEFAULT_SCAN_SEGMENTS = 4
+TABLE_CACHE_DIR = Path.home() / '.cache' / 'campo-vision'
+TABLE_CACHE_TTL = 300  # seconds
+
+# Table name fragments that identify Campo Vision tables
+CAMPO_VISION_TABLE_PATTERN = re.compile(
+    r'telemetry|company|device|user.*company|campo.*vision',
+    re.IGNORECASE
+)
+BATCH_WRITE_MAX_ATTEMPTS = 8
+
 
 def parse_args():
     """Parse command line arguments."""
@@ -33,6 +58,11 @@ def parse_args():
     parser.add_argument('--region', default='us-east-1', help='AWS region to use')
     parser.add_argument('--list-only', action='store_true', help='Only list available tables without clearing any data')
     parser.add_argument('--tables', nargs='+', help='Specific tables to clear (space-separated)')
+    parser.add_argument('--scan-segments', type=int, default=DEFAULT_SCAN_SEGMENTS,
+                        help='Number of parallel scan segments per table')
+    parser.add_argument('--refresh', action='store_true', help='Ignore the cached table list and fetch it again')
+    parser.add_argument('--recreate', action='store_true',
+                        help='Drop and re-create tables instead of deleting every item')
     return parser.parse_args()
 
 
@@ -46,22 +76,61 @@ def list_dynamodb_tables(dynamodb_client):
     Returns:
         List of table names
     """
-    tables = []
-    last_evaluated_table_name = None
+    paginator = dynamodb_client.get_paginator('list_tables')
+    return [
+        table
+        for page in paginator.paginate(PaginationConfig={'PageSize': 100})
+        for table in page.get('TableNames', [])
+    ]
+
+
+def get_table_cache_path(profile, region):
+    """
+    Get the path of the cached table list for a profile and region.
     
-    while True:
-        if last_evaluated_table_name:
-            response = dynamodb_client.list_tables(ExclusiveStartTableName=last_evaluated_table_name)
-        else:
-            response = dynamodb_client.list_tables()
-            
-        tables.extend(response.get('TableNames', []))
+    Args:
+        profile: AWS profile name, or None for the default credentials
+        region: AWS region
         
-        last_evaluated_table_name = response.get('LastEvaluatedTableName')
-        if not last_evaluated_table_name:
-            break
+    Returns:
+        Path of the cache file
+    """
+    return TABLE_CACHE_DIR / f"tables-{profile or 'default'}-{region}.json"
+
+
+def load_cached_tables(cache_path):
+    """
+    Load the cached table list if it is younger than TABLE_CACHE_TTL.
     
-    return tables
+    Args:
+        cache_path: Path of the cache file
+        
+    Returns:
+        List of table names, or None if there is no fresh cache
+    """
+    try:
+        if time.time() - cache_path.stat().st_mtime > TABLE_CACHE_TTL:
+            return None
+        with open(cache_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_cached_tables(cache_path, tables):
+    """
+    Save the table list to the cache, ignoring write failures.
+    
+    Args:
+        cache_path: Path of the cache file
+        tables: List of table names
+    """
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, 'w') as f:
+            json.dump(tables, f)
+    except OSError as e:
+        print(f"Warning: Could not cache table list: {e}")
 
 
 def filter_campo_vision_tables(tables):
@@ -74,24 +143,7 @@ def filter_campo_vision_tables(tables):
     Returns:
         List of Campo Vision table names
     """
-    # Patterns to look for in table names
-    patterns = [
-        r'.*telemetry.*',
-        r'.*company.*',
-        r'.*device.*',
-        r'.*user.*company.*',
-        r'.*campo.*vision.*'
-    ]
-    
-    campo_vision_tables = []
-    
-    for table in tables:
-        for pattern in patterns:
-            if re.search(pattern, table.lower()):
-                campo_vision_tables.append(table)
-                break
-    
-    return campo_vision_tables
+    return [table for table in tables if CAMPO_VISION_TABLE_PATTERN.search(table)]
 
 
 def select_tables_to_clear(all_tables, campo_vision_tables, specified_tables=None):
@@ -165,13 +217,88 @@ def select_tables_to_clear(all_tables, campo_vision_tables, specified_tables=Non
         sys.exit(1)
 
 
-def clear_table(dynamodb, table_name):
+def iter_table_items(table, **scan_kwargs):
+    """
+    Yield every item in a table, one scan page at a time.
+    
+    Args:
+        table: DynamoDB Table resource
+        scan_kwargs: Extra arguments passed to each scan call
+        
+    Yields:
+        Table items
+    """
+    while True:
+        response = table.scan(**scan_kwargs)
+        yield from response.get('Items', [])
+        
+        if 'LastEvaluatedKey' not in response:
+            return
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def iter_delete_batches(items, hash_key, range_key, batch_size=25):
+    """
+    Group items into BatchWriteItem-sized lists of DeleteRequests.
+    
+    Args:
+        items: Iterable of table items
+        hash_key: Name of the hash key attribute
+        range_key: Name of the range key attribute, or None
+        batch_size: Maximum batch size for BatchWriteItem
+        
+    Yields:
+        Lists of DeleteRequest entries
+    """
+    items = iter(items)
+    while True:
+        batch_request = []
+        for item in islice(items, batch_size):
+            key = {hash_key: item[hash_key]}
+            if range_key and range_key in item:
+                key[range_key] = item[range_key]
+            batch_request.append({'DeleteRequest': {'Key': key}})
+        
+        if not batch_request:
+            return
+        yield batch_request
+
+
+def delete_batch(dynamodb, table_name, batch_request):
+    """
+    Delete one batch of items, retrying unprocessed items with backoff.
+    
+    Args:
+        dynamodb: DynamoDB resource
+        table_name: Name of the table
+        batch_request: List of up to 25 DeleteRequest entries
+        
+    Returns:
+        Tuple of (deleted count, unprocessed count)
+    """
+    pending = batch_request
+    for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+        response = dynamodb.batch_write_item(
+            RequestItems={
+                table_name: pending
+            }
+        )
+        pending = response.get('UnprocessedItems', {}).get(table_name, [])
+        if not pending:
+            break
+        time.sleep(min(0.05 * 2 ** attempt, 1))
+    
+    return len(batch_request) - len(pending), len(pending)
+
+
+def clear_table(dynamodb, table_name, scan_segments=DEFAULT_SCAN_SEGMENTS):
     """
     Clear all items from the specified DynamoDB table.
     
     Args:
         dynamodb: DynamoDB resource
         table_name: Name of the table to clear
+        scan_segments: Number of parallel scan segments
     """
     try:
         table = dynamodb.Table(table_name)
@@ -190,66 +317,90 @@ def clear_table(dynamodb, table_name):
             print(f"Could not identify hash key for table {table_name}")
             return False
         
-        # Scan the table to get all items
-        print(f"Scanning table {table_name}...")
-        items = []
-        scan_kwargs = {}
-        done = False
+        # Stream items from the scan straight into delete batches so only a
+        # bounded number of batches is held in memory at any time
+        print(f"Scanning and deleting items from {table_name}...")
         start_time = time.time()
+        deleted = 0
+        unprocessed_total = 0
+        in_flight = set()
         
-        while not done:
-            response = table.scan(**scan_kwargs)
-            items.extend(response.get('Items', []))
-            
-            # Print progress
-            print(f"Retrieved {len(items)} items so far...")
-            
-            if 'LastEvaluatedKey' not in response:
-                done = True
-            else:
-                scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        def collect(futures):
+            nonlocal deleted, unprocessed_total
+            for future in futures:
+                batch_deleted, batch_unprocessed = future.result()
+                deleted += batch_deleted
+                unprocessed_total += batch_unprocessed
+            print(f"Deleted {deleted} items so far...")
         
-        total_items = len(items)
-        print(f"Found {total_items} items in {table_name}")
+        # Only the key attributes are needed to build the DeleteRequests
+        scan_kwargs = {
+            'Select': 'SPECIFIC_ATTRIBUTES',
+            'ProjectionExpression': '#h',
+            'ExpressionAttributeNames': {'#h': hash_key}
+        }
+        if range_key:
+            scan_kwargs['ProjectionExpression'] += ', #r'
+            scan_kwargs['ExpressionAttributeNames']['#r'] = range_key
         
-        if total_items == 0:
-            print(f"Table {table_name} is already empty")
-            return True
+        # Each scan segment feeds its delete batches into a bounded queue;
+        # None marks the end of a segment
+        total_segments = max(1, scan_segments)
+        batch_queue = queue.Queue(maxsize=MAX_IN_FLIGHT_BATCHES)
+        stop = threading.Event()
         
-        # Delete all items
-        print(f"Deleting {total_items} items from {table_name}...")
-        deleted = 0
-        batch_size = 25  # Maximum batch size for BatchWriteItem
+        def offer(value):
+            while not stop.is_set():
+                try:
+                    batch_queue.put(value, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
         
-        for i in range(0, total_items, batch_size):
-            batch = items[i:i + batch_size]
-            batch_request = []
-            
-            for item in batch:
-                delete_request = {'DeleteRequest': {'Key': {}}}
-                delete_request['DeleteRequest']['Key'][hash_key] = item[hash_key]
-                
-                if range_key and range_key in item:
-                    delete_request['DeleteRequest']['Key'][range_key] = item[range_key]
+        def scan_segment(segment):
+            try:
+                items = iter_table_items(table, Segment=segment, TotalSegments=total_segments, **scan_kwargs)
+                for batch_request in iter_delete_batches(items, hash_key, range_key):
+                    if not offer(batch_request):
+                        return
+            finally:
+                offer(None)
+        
+        with ThreadPoolExecutor(max_workers=total_segments) as scanner, \
+                ThreadPoolExecutor(max_workers=DELETE_WORKERS) as executor:
+            scans = [scanner.submit(scan_segment, segment) for segment in range(total_segments)]
+            try:
+                finished = 0
+                while finished < total_segments:
+                    batch_request = batch_queue.get()
+                    if batch_request is None:
+                        finished += 1
+                        continue
+                    
+                    in_flight.add(executor.submit(delete_batch, dynamodb, table_name, batch_request))
+                    if len(in_flight) >= MAX_IN_FLIGHT_BATCHES:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        collect(done)
                 
-                batch_request.append(delete_request)
-            
-            response = dynamodb.batch_write_item(
-                RequestItems={
-                    table_name: batch_request
-                }
-            )
-            
-            # Handle unprocessed items
-            unprocessed = response.get('UnprocessedItems', {}).get(table_name, [])
-            if unprocessed:
-                print(f"Warning: {len(unprocessed)} items were not processed in this batch")
+                if in_flight:
+                    collect(wait(in_flight).done)
+            finally:
+                stop.set()
             
-            deleted += len(batch) - len(unprocessed)
-            print(f"Deleted {deleted}/{total_items} items...")
+            for scan in scans:
+                scan.result()
+        
+        if deleted == 0 and unprocessed_total == 0:
+            print(f"Table {table_name} is already empty")
+            return True
+        
+        if unprocessed_total:
+            print(f"Warning: {unprocessed_total} items could not be deleted from {table_name}")
+            return False
         
         elapsed_time = time.time() - start_time
-        print(f"Successfully cleared table {table_name} in {elapsed_time:.2f} seconds")
+        print(f"Successfully deleted {deleted} items from table {table_name} in {elapsed_time:.2f} seconds")
         return True
     
     except ClientError as e:
@@ -257,6 +408,188 @@ def clear_table(dynamodb, table_name):
         return False
 
 
+def get_recreate_blockers(description):
+    """
+    List the table features that recreate_table cannot carry over.
+    
+    Args:
+        description: Table description from DescribeTable
+        
+    Returns:
+        List of human readable reasons, empty if the table can be re-created
+    """
+    blockers = []
+    if description.get('Replicas'):
+        blockers.append('it is a global table')
+    if description.get('DeletionProtectionEnabled'):
+        blockers.append('deletion protection is enabled')
+    if description.get('StreamSpecification', {}).get('StreamEnabled'):
+        blockers.append('re-creating it would change its stream ARN')
+    return blockers
+
+
+def build_create_table_kwargs(description, tags):
+    """
+    Build CreateTable arguments that reproduce an existing table.
+    
+    Args:
+        description: Table description from DescribeTable
+        tags: Tags of the existing table
+        
+    Returns:
+        Keyword arguments for create_table
+    """
+    billing_mode = description.get('BillingModeSummary', {}).get('BillingMode', 'PROVISIONED')
+    
+    def throughput(source):
+        return {
+            'ReadCapacityUnits': source['ProvisionedThroughput']['ReadCapacityUnits'],
+            'WriteCapacityUnits': source['ProvisionedThroughput']['WriteCapacityUnits']
+        }
+    
+    kwargs = {
+        'TableName': description['TableName'],
+        'KeySchema': description['KeySchema'],
+        'AttributeDefinitions': description['AttributeDefinitions'],
+        'BillingMode': billing_mode
+    }
+    if billing_mode == 'PROVISIONED':
+        kwargs['ProvisionedThroughput'] = throughput(description)
+    
+    global_indexes = []
+    for index in description.get('GlobalSecondaryIndexes', []):
+        global_index = {
+            'IndexName': index['IndexName'],
+            'KeySchema': index['KeySchema'],
+            'Projection': index['Projection']
+        }
+        if billing_mode == 'PROVISIONED':
+            global_index['ProvisionedThroughput'] = throughput(index)
+        global_indexes.append(global_index)
+    if global_indexes:
+        kwargs['GlobalSecondaryIndexes'] = global_indexes
+    
+    local_indexes = [
+        {
+            'IndexName': index['IndexName'],
+            'KeySchema': index['KeySchema'],
+            'Projection': index['Projection']
+        }
+        for index in description.get('LocalSecondaryIndexes', [])
+    ]
+    if local_indexes:
+        kwargs['LocalSecondaryIndexes'] = local_indexes
+    
+    sse = description.get('SSEDescription', {})
+    if sse.get('Status') == 'ENABLED' and sse.get('SSEType') == 'KMS':
+        kwargs['SSESpecification'] = {
+            'Enabled': True,
+            'SSEType': 'KMS',
+            'KMSMasterKeyId': sse['KMSMasterKeyArn']
+        }
+    
+    table_class = description.get('TableClassSummary', {}).get('TableClass')
+    if table_class:
+        kwargs['TableClass'] = table_class
+    
+    if tags:
+        kwargs['Tags'] = tags
+    
+    return kwargs
+
+
+def recreate_table(dynamodb_client, table_name):
+    """
+    Clear a table by dropping it and creating it again with the same settings.
+    
+    Tables managed by CloudFormation (such as the SAM stack's tables) drift
+    from their stack: the re-created table is not the physical resource the
+    stack created, and it loses the stack's aws:cloudformation:* tags. If the
+    table cannot be re-created after it has been deleted, the saved settings
+    are printed and the script exits.
+    
+    Args:
+        dynamodb_client: DynamoDB client
+        table_name: Name of the table to clear
+        
+    Returns:
+        True on success, False on failure, or None if the table has features
+        that cannot be re-created and should be cleared item by item instead
+    """
+    try:
+        description = dynamodb_client.describe_table(TableName=table_name)['Table']
+        
+        blockers = get_recreate_blockers(description)
+        if blockers:
+            print(f"Cannot re-create table {table_name}: {', '.join(blockers)}")
+            return None
+        
+        # Capture everything that has to be restored before dropping the table
+        tags = []
+        paginator = dynamodb_client.get_paginator('list_tags_of_resource')
+        for page in paginator.paginate(ResourceArn=description['TableArn']):
+            tags.extend(page.get('Tags', []))
+        
+        # CreateTable rejects tag keys with the reserved aws: prefix
+        if any(tag['Key'] == 'aws:cloudformation:stack-name' for tag in tags):
+            print(f"Warning: {table_name} is managed by CloudFormation; re-creating it drifts it from its stack")
+        tags = [tag for tag in tags if not tag['Key'].startswith('aws:')]
+        
+        ttl = dynamodb_client.describe_time_to_live(TableName=table_name).get('TimeToLiveDescription', {})
+        backups = dynamodb_client.describe_continuous_backups(TableName=table_name)
+        pitr_status = backups['ContinuousBackupsDescription'].get(
+            'PointInTimeRecoveryDescription', {}
+        ).get('PointInTimeRecoveryStatus')
+        
+        create_kwargs = build_create_table_kwargs(description, tags)
+        
+        print(f"Deleting table {table_name}...")
+        start_time = time.time()
+        dynamodb_client.delete_table(TableName=table_name)
+    
+    except ClientError as e:
+        print(f"Error re-creating table {table_name}: {e}")
+        return False
+    
+    try:
+        dynamodb_client.get_waiter('table_not_exists').wait(
+            TableName=table_name, WaiterConfig={'Delay': 5}
+        )
+        
+        print(f"Re-creating table {table_name}...")
+        dynamodb_client.create_table(**create_kwargs)
+        dynamodb_client.get_waiter('table_exists').wait(
+            TableName=table_name, WaiterConfig={'Delay': 5}
+        )
+        
+        if ttl.get('TimeToLiveStatus') in ('ENABLED', 'ENABLING'):
+            dynamodb_client.update_time_to_live(
+                TableName=table_name,
+                TimeToLiveSpecification={'Enabled': True, 'AttributeName': ttl['AttributeName']}
+            )
+        
+        if pitr_status == 'ENABLED':
+            dynamodb_client.update_continuous_backups(
+                TableName=table_name,
+                PointInTimeRecoverySpecification={'PointInTimeRecoveryEnabled': True}
+            )
+    
+    except Exception as e:
+        # The table is already gone, so don't carry on with other tables
+        print(f"\nERROR: Table {table_name} was deleted but could not be fully re-created: {e}")
+        print("Re-create it with these CreateTable settings:")
+        print(json.dumps(create_kwargs, indent=2, default=str))
+        if ttl.get('TimeToLiveStatus') in ('ENABLED', 'ENABLING'):
+            print(f"Then enable TTL on attribute '{ttl['AttributeName']}'")
+        if pitr_status == 'ENABLED':
+            print("Then enable point-in-time recovery")
+        sys.exit(1)
+    
+    elapsed_time = time.time() - start_time
+    print(f"Successfully re-created table {table_name} in {elapsed_time:.2f} seconds")
+    return True
+
+
 def main():
     """Main function."""
     args = parse_args()
@@ -267,12 +600,25 @@ def main():
         session_kwargs['profile_name'] = args.profile
     
     session = boto3.Session(**session_kwargs)
-    dynamodb = session.resource('dynamodb')
+    # Size the connection pool for the parallel deletes and let the SDK
+    # back off adaptively when the table throttles
+    client_config = Config(
+        max_pool_connections=32,
+        retries={'max_attempts': 10, 'mode': 'adaptive'}
+    )
+    dynamodb = session.resource('dynamodb', config=client_config)
     dynamodb_client = session.client('dynamodb')
     
     # List all tables in the account
-    print("Listing DynamoDB tables...")
-    all_tables = list_dynamodb_tables(dynamodb_client)
+    cache_path = get_table_cache_path(args.profile, args.region)
+    all_tables = None if args.refresh else load_cached_tables(cache_path)
+    
+    if all_tables is None:
+        print("Listing DynamoDB tables...")
+        all_tables = list_dynamodb_tables(dynamodb_client)
+        save_cached_tables(cache_path, all_tables)
+    else:
+        print(f"Using cached table list from {cache_path} (use --refresh to reload)")
     
     if not all_tables:
         print("No DynamoDB tables found in your AWS account")
@@ -321,7 +667,15 @@ def main():
         print(f"Processing table: {table_name}")
         print(f"{'=' * 50}")
         
-        if not clear_table(dynamodb, table_name):
+        if args.recreate:
+            recreated = recreate_table(dynamodb_client, table_name)
+            if recreated is not None:
+                if not recreated:
+                    success = False
+                continue
+            print("Falling back to deleting items one batch at a time")
+        
+        if not clear_table(dynamodb, table_name, args.scan_segments):
             success = False
     
     if success:
@@ -8,40 +8,139 @@ It can be used by your backend API to provision new devices through the Android
 Usage:
   python scripts/create_device_certificate.py --device-id <device-id> [--company-id <company-id>] [--skip-dynamodb]
   python scripts/create_device_certificate.py --device-id dev-massey-ferguson-178 --company-id comp-a786e492-4883-4ade-b948-a818c2465fd8
+  python scripts/create_device_certificate.py --device-ids-file devices.txt [--company-id <company-id>] [--skip-dynamodb]
 """
 
 import argparse
 import boto3
-import json
+import orjson
 import os
+import threading
+import time
 import uuid
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 from pathlib import Path
 from dotenv import load_dotenv
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 
 # Load environment variables from .env file
 env_path = Path(__file__).parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
-def create_certificate(device_id, company_id=None):
+# Naming and IoT settings are the same for every device, so read them once
+THING_NAME_PREFIX = os.environ.get('THING_NAME_PREFIX', 'campo-vision-')
+IOT_POLICY_NAME = os.environ.get('IOT_POLICY_NAME', 'CampoVisionIoTPolicy')
+IOT_THING_GROUP = os.environ.get('IOT_THING_GROUP', 'CampoVisionDevices')
+
+# The IoT data endpoint is stable per account and region, so it is cached in
+# memory for this run and on disk for later runs
+ENDPOINT_CACHE_DIR = Path.home() / '.cache' / 'campo-vision'
+ENDPOINT_CACHE_TTL = 24 * 60 * 60  # seconds
+_iot_endpoints = {}
+
+# Number of devices provisioned concurrently with --device-ids-file
+PROVISION_WORKERS = 16
+
+# BatchWriteItem accepts at most 25 items per request
+BATCH_WRITE_SIZE = 25
+BATCH_WRITE_MAX_ATTEMPTS = 5
+
+# One session and one set of clients are shared by every device provisioned in
+# this run; building a client loads its service model from disk
+client_config = Config(
+    max_pool_connections=32,
+    retries={'max_attempts': 5, 'mode': 'adaptive'}
+)
+session = None
+iot_client = None
+dynamodb = None
+account_id = None
+clients_lock = threading.Lock()
+
+def get_session():
+    """
+    Returns the shared boto3 session, creating it on first use
+    """
+    global session
+    with clients_lock:
+        if session is None:
+            session = boto3.Session()
+        return session
+
+def get_iot_client():
+    """
+    Returns the shared AWS IoT client, creating it on first use
+    """
+    global iot_client
+    if iot_client is None:
+        client_session = get_session()
+        with clients_lock:
+            if iot_client is None:
+                iot_client = client_session.client('iot', config=client_config)
+    return iot_client
+
+def get_dynamodb():
+    """
+    Returns the shared DynamoDB resource, creating it on first use
+    """
+    global dynamodb
+    if dynamodb is None:
+        client_session = get_session()
+        with clients_lock:
+            if dynamodb is None:
+                dynamodb = client_session.resource('dynamodb', config=client_config)
+    return dynamodb
+
+def get_account_id():
+    """
+    Returns the AWS account ID of the shared session's credentials
+    """
+    global account_id
+    if account_id is None:
+        client_session = get_session()
+        with clients_lock:
+            if account_id is None:
+                account_id = client_session.client('sts').get_caller_identity()['Account']
+    return account_id
+
+def delete_new_certificate(iot_client, certificate_id):
+    """
+    Deletes a certificate created by create_certificate after a failed step
+    
+    Args:
+        iot_client: AWS IoT client
+        certificate_id (str): ID of the certificate to delete
+    """
+    # IoT refuses to delete an ACTIVE certificate, even with forceDelete, so
+    # it has to be deactivated first
+    iot_client.update_certificate(
+        certificateId=certificate_id,
+        newStatus='INACTIVE'
+    )
+    iot_client.delete_certificate(
+        certificateId=certificate_id,
+        forceDelete=True
+    )
+
+def create_certificate(device_id, company_id=None, iot_client=None):
     """
     Creates an X.509 certificate for a device and registers it with AWS IoT Core
     
     Args:
         device_id (str): Unique identifier for the device
         company_id (str, optional): Company ID to associate with the device
+        iot_client (optional): AWS IoT client, defaults to the shared client
         
     Returns:
         dict: Certificate information including certificateArn, certificateId, 
               certificatePem, privateKey, and thing name
     """
-    # Initialize AWS IoT client
-    iot_client = boto3.client('iot')
+    if iot_client is None:
+        iot_client = get_iot_client()
     
-    # Prefix for thing name
-    prefix = os.environ.get('THING_NAME_PREFIX', 'campo-vision-')
-    thing_name = f"{prefix}{device_id}"
+    thing_name = f"{THING_NAME_PREFIX}{device_id}"
     
     # Check if thing already exists
     try:
@@ -62,25 +161,15 @@ def create_certificate(device_id, company_id=None):
     certificate_pem = certificate_response['certificatePem']
     private_key = certificate_response['keyPair']['PrivateKey']
     
-    # Get policy name from environment or use default
-    policy_name = os.environ.get('IOT_POLICY_NAME', 'CampoVisionIoTPolicy')
-    
-    # Attach policy to certificate
+    # Attach policy to certificate; a new certificate never has it attached yet
     try:
         iot_client.attach_policy(
-            policyName=policy_name,
+            policyName=IOT_POLICY_NAME,
             target=certificate_arn
         )
     except ClientError as e:
         # Clean up certificate if policy attachment fails
-        iot_client.update_certificate(
-            certificateId=certificate_id,
-            newStatus='INACTIVE'
-        )
-        iot_client.delete_certificate(
-            certificateId=certificate_id,
-            forceDelete=True
-        )
+        delete_new_certificate(iot_client, certificate_id)
         raise Exception(f"Error attaching policy: {str(e)}")
     
     # Create or update thing
@@ -110,14 +199,7 @@ def create_certificate(device_id, company_id=None):
             )
     except ClientError as e:
         # Clean up certificate if thing creation fails
-        iot_client.update_certificate(
-            certificateId=certificate_id,
-            newStatus='INACTIVE'
-        )
-        iot_client.delete_certificate(
-            certificateId=certificate_id,
-            forceDelete=True
-        )
+        delete_new_certificate(iot_client, certificate_id)
         print(f"Error creating thing: {str(e)}")
         raise e
     
@@ -131,33 +213,22 @@ def create_certificate(device_id, company_id=None):
         # Clean up if attaching fails
         if not thing_exists:
             iot_client.delete_thing(thingName=thing_name)
-        iot_client.update_certificate(
-            certificateId=certificate_id,
-            newStatus='INACTIVE'
-        )
-        iot_client.delete_certificate(
-            certificateId=certificate_id,
-            forceDelete=True
-        )
+        delete_new_certificate(iot_client, certificate_id)
         raise Exception(f"Error attaching certificate to thing: {str(e)}")
     
     # Add thing to the Campo Vision Thing Group
     try:
-        # Get group name from environment or use default
-        group_name = os.environ.get('IOT_THING_GROUP', 'CampoVisionDevices')
-        
-        # Add thing to group
         iot_client.add_thing_to_thing_group(
             thingName=thing_name,
-            thingGroupName=group_name
+            thingGroupName=IOT_THING_GROUP
         )
-        print(f"Added device {thing_name} to group {group_name}")
+        print(f"Added device {thing_name} to group {IOT_THING_GROUP}")
     except ClientError as e:
         print(f"Warning: Could not add device to thing group: {str(e)}")
         # We don't raise an exception here as this is not critical for device creation
     
     # Save certificates to files
-    save_certificate_files(device_id, certificate_pem, private_key)
+    save_certificate_files(device_id, certificate_pem, private_key, iot_client)
     
     # Return device information
     device_info = {
@@ -175,7 +246,47 @@ def create_certificate(device_id, company_id=None):
     
     return device_info
 
-def save_certificate_files(device_id, certificate_pem, private_key):
+def get_iot_endpoint(iot_client):
+    """
+    Returns the AWS IoT data endpoint, using the cache when possible
+    
+    Args:
+        iot_client: AWS IoT client
+        
+    Returns:
+        str: The iot:Data-ATS endpoint address
+    """
+    # The endpoint differs per account, so switching profiles must not
+    # reuse another account's cached endpoint
+    account = get_account_id()
+    region = iot_client.meta.region_name
+    cache_key = (account, region)
+    if cache_key in _iot_endpoints:
+        return _iot_endpoints[cache_key]
+    
+    cache_path = ENDPOINT_CACHE_DIR / f"iot-endpoint-{account}-{region}.txt"
+    try:
+        if time.time() - cache_path.stat().st_mtime <= ENDPOINT_CACHE_TTL:
+            endpoint = cache_path.read_text().strip()
+            if endpoint:
+                _iot_endpoints[cache_key] = endpoint
+                return endpoint
+    except OSError:
+        pass
+    
+    endpoint_response = iot_client.describe_endpoint(endpointType='iot:Data-ATS')
+    endpoint = endpoint_response['endpointAddress']
+    _iot_endpoints[cache_key] = endpoint
+    
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(endpoint)
+    except OSError as e:
+        print(f"Warning: Could not cache IoT endpoint: {str(e)}")
+    
+    return endpoint
+
+def save_certificate_files(device_id, certificate_pem, private_key, iot_client):
     output_dir = f"certificates/{device_id}"
     os.makedirs(output_dir, exist_ok=True)
     
@@ -185,17 +296,38 @@ def save_certificate_files(device_id, certificate_pem, private_key):
     with open(f"{output_dir}/private.key", "w") as key_file:
         key_file.write(private_key)
         
-    # Get AWS IoT endpoint
-    iot_client = boto3.client('iot')
-    endpoint_response = iot_client.describe_endpoint(endpointType='iot:Data-ATS')
-    endpoint = endpoint_response['endpointAddress']
+    endpoint = get_iot_endpoint(iot_client)
     
-    with open(f"{output_dir}/config.json", "w") as config_file:
+    with open(f"{output_dir}/config.json", "wb") as config_file:
         config = {
             "deviceId": device_id,
             "endpoint": endpoint
         }
-        json.dump(config, config_file, indent=2)
+        config_file.write(orjson.dumps(config, option=orjson.OPT_INDENT_2))
+
+def build_device_item(device_info):
+    """
+    Builds the DynamoDB device table item for a provisioned device
+    
+    Args:
+        device_info (dict): Device information including deviceId and companyId
+        
+    Returns:
+        dict: The item to store in the device table
+    """
+    device_item = {
+        'deviceId': device_info['deviceId'],
+        'thingName': device_info['thingName'],
+        'certificateId': device_info['certificateId'],
+        'createdAt': datetime.now(timezone.utc).isoformat(),
+        'status': 'ACTIVE'
+    }
+    
+    # Add company ID if provided
+    if device_info.get('companyId'):
+        device_item['companyId'] = device_info['companyId']
+    
+    return device_item
 
 def register_device_in_dynamodb(device_info):
     """
@@ -205,30 +337,14 @@ def register_device_in_dynamodb(device_info):
         device_info (dict): Device information including deviceId and companyId
     """
     try:
-        # Initialize DynamoDB resource
-        dynamodb = boto3.resource('dynamodb')
-        
         # Get table name from environment or use default
         table_name = os.environ.get('DEVICE_TABLE', 'DeviceTable')
         print(f"Using DynamoDB table: {table_name}")
         
-        table = dynamodb.Table(table_name)
-        
-        # Create item for DynamoDB
-        device_item = {
-            'deviceId': device_info['deviceId'],
-            'thingName': device_info['thingName'],
-            'certificateId': device_info['certificateId'],
-            'createdAt': datetime.utcnow().isoformat(),
-            'status': 'ACTIVE'
-        }
-        
-        # Add company ID if provided
-        if device_info.get('companyId'):
-            device_item['companyId'] = device_info['companyId']
+        table = get_dynamodb().Table(table_name)
         
         # Store in DynamoDB
-        table.put_item(Item=device_item)
+        table.put_item(Item=build_device_item(device_info))
         
         print(f"Device {device_info['deviceId']} registered in DynamoDB")
         return True
@@ -244,21 +360,191 @@ def register_device_in_dynamodb(device_info):
         print(f"Unexpected error registering device in DynamoDB: {str(e)}")
         return False
 
+class BulkDeviceRegistrar:
+    """
+    Registers devices in the DynamoDB device table in BatchWriteItem calls
+    
+    Items are sent in groups of 25 and unprocessed items are retried with
+    backoff. Results are tracked per device: failed maps exactly the devices
+    that were not written to the error. put() may be called from several
+    threads; the remaining items are written when the context exits.
+    """
+    
+    def __init__(self, table_name=None):
+        self.table_name = table_name or os.environ.get('DEVICE_TABLE', 'DeviceTable')
+        self.failed = {}
+        self._buffer = []
+        self._lock = threading.Lock()
+    
+    def __enter__(self):
+        print(f"Using DynamoDB table: {self.table_name}")
+        return self
+    
+    def put(self, device_info):
+        """
+        Queues a device for registration, writing a batch once 25 are queued
+        
+        Args:
+            device_info (dict): Device information including deviceId and companyId
+        """
+        device_item = build_device_item(device_info)
+        with self._lock:
+            self._buffer.append(device_item)
+            if len(self._buffer) < BATCH_WRITE_SIZE:
+                return
+            batch, self._buffer = self._buffer, []
+        self._write(batch)
+    
+    def _write(self, batch):
+        """
+        Writes a batch of device items, recording the devices left unwritten
+        
+        Args:
+            batch (list): Up to 25 device items
+        """
+        requests = [{'PutRequest': {'Item': item}} for item in batch]
+        try:
+            for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+                response = get_dynamodb().batch_write_item(RequestItems={self.table_name: requests})
+                requests = response.get('UnprocessedItems', {}).get(self.table_name, [])
+                if not requests:
+                    return
+                if attempt < BATCH_WRITE_MAX_ATTEMPTS - 1:
+                    # Back off before retrying throttled items
+                    time.sleep(min(0.05 * 2 ** attempt, 1))
+            error = 'still unprocessed after retries'
+        except (BotoCoreError, ClientError) as e:
+            # Items of earlier attempts were written; the rest were not
+            error = str(e)
+        
+        with self._lock:
+            for request in requests:
+                self.failed[request['PutRequest']['Item']['deviceId']] = error
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if batch:
+            self._write(batch)
+        return False
+
+def read_device_ids(path):
+    """
+    Reads device IDs from a file with one ID per line
+    
+    Args:
+        path (str): Path of the file
+        
+    Returns:
+        list: Unique device IDs in file order, skipping blank lines
+    """
+    with open(path) as f:
+        return list(dict.fromkeys(line.strip() for line in f if line.strip()))
+
+def provision_device(device_id, company_id=None, skip_dynamodb=False, registrar=None):
+    """
+    Creates the certificate and thing for a device and registers it in DynamoDB
+    
+    Args:
+        device_id (str): Unique identifier for the device
+        company_id (str, optional): Company ID to associate with the device
+        skip_dynamodb (bool): Skip registering the device in DynamoDB
+        registrar (BulkDeviceRegistrar, optional): Batches the DynamoDB write
+            instead of writing the device on its own
+        
+    Returns:
+        dict: Device information returned by create_certificate
+    """
+    device_info = create_certificate(device_id, company_id)
+    
+    if skip_dynamodb:
+        return device_info
+    
+    if registrar:
+        registrar.put(device_info)
+    else:
+        register_device_in_dynamodb(device_info)
+    
+    return device_info
+
+def provision_devices(device_ids, company_id=None, skip_dynamodb=False):
+    """
+    Provisions several devices concurrently, sharing one set of AWS clients
+    
+    Args:
+        device_ids (list): Device IDs to provision
+        company_id (str, optional): Company ID to associate with every device
+        skip_dynamodb (bool): Skip registering the devices in DynamoDB
+        
+    Returns:
+        list: Device IDs that could not be provisioned
+    """
+    # Create the shared client before the workers start using it
+    get_iot_client()
+    
+    failed = []
+    created = []
+    registrar = None if skip_dynamodb else BulkDeviceRegistrar()
+    
+    def run(executor):
+        futures = {
+            executor.submit(provision_device, device_id, company_id, skip_dynamodb, registrar): device_id
+            for device_id in device_ids
+        }
+        for future in as_completed(futures):
+            device_id = futures[future]
+            try:
+                future.result()
+                created.append(device_id)
+            except Exception as e:
+                print(f"Error provisioning device {device_id}: {str(e)}")
+                failed.append(device_id)
+    
+    with ThreadPoolExecutor(max_workers=min(PROVISION_WORKERS, len(device_ids))) as executor:
+        if registrar is None:
+            run(executor)
+        else:
+            with registrar:
+                run(executor)
+    
+    # Devices only count as provisioned once their DynamoDB write is confirmed
+    for device_id in created:
+        if registrar and device_id in registrar.failed:
+            print(f"Error registering device {device_id} in DynamoDB: {registrar.failed[device_id]}")
+            print("The certificate was still created successfully.")
+            failed.append(device_id)
+        else:
+            print(f"Device {device_id} successfully provisioned")
+    
+    return failed
+
 def main():
     parser = argparse.ArgumentParser(description='Create IoT certificate for ESP32 device')
-    parser.add_argument('--device-id', required=True, help='Device ID')
+    device_group = parser.add_mutually_exclusive_group(required=True)
+    device_group.add_argument('--device-id', help='Device ID')
+    device_group.add_argument('--device-ids-file', help='File with one device ID per line to provision in bulk')
     parser.add_argument('--company-id', help='Company ID')
     parser.add_argument('--skip-dynamodb', action='store_true', help='Skip registering in DynamoDB')
     
     args = parser.parse_args()
     
-    try:
-        # Create certificate and thing
-        device_info = create_certificate(args.device_id, args.company_id)
+    if args.device_ids_file:
+        device_ids = read_device_ids(args.device_ids_file)
+        if not device_ids:
+            print(f"No device IDs found in {args.device_ids_file}")
+            exit(1)
         
-        # Register device in DynamoDB (unless skipped)
-        if not args.skip_dynamodb:
-            register_device_in_dynamodb(device_info)
+        print(f"Provisioning {len(device_ids)} devices...")
+        failed = provision_devices(device_ids, args.company_id, args.skip_dynamodb)
+        print(f"Provisioned {len(device_ids) - len(failed)}/{len(device_ids)} devices")
+        if failed:
+            print(f"Failed devices: {', '.join(failed)}")
+            exit(1)
+        return
+    
+    try:
+        # Create certificate and thing, then register it in DynamoDB (unless skipped)
+        provision_device(args.device_id, args.company_id, args.skip_dynamodb)
         
         # Print success message
         print(f"Device {args.device_id} successfully provisioned")
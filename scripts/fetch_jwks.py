@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Script to bundle the Cognito JWKS into the Campo Vision Lambda layer.
+
+The auth module in layers/python loads jwks.json from disk at import time so
+cold Lambda invocations don't pay for an HTTPS round trip to Cognito. Run this
+script before `sam build` to refresh the bundled keys.
+
+Usage:
+    python scripts/fetch_jwks.py [--region REGION] [--user-pool-id POOL_ID] [--output PATH]
+    python scripts/fetch_jwks.py --stack-name campo-vision
+
+Options:
+    --region REGION          AWS region of the user pool (default: AWS_REGION or us-east-1)
+    --user-pool-id POOL_ID   Cognito User Pool ID (default: USER_POOL_ID)
+    --stack-name STACK       Read the User Pool ID from the CloudFormation stack outputs
+    --output PATH            Where to write the JWKS (default: layers/python/jwks.json)
+"""
+
+import argparse
+import json
+import os
+import sys
+import urllib.request
+from pathlib import Path
+
+DEFAULT_OUTPUT = Path(__file__).resolve().parent.parent / 'layers' / 'python' / 'jwks.json'
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Bundle the Cognito JWKS into the Lambda layer.')
+    parser.add_argument('--region', default=os.environ.get('AWS_REGION', 'us-east-1'), help='AWS region of the user pool')
+    parser.add_argument('--user-pool-id', default=os.environ.get('USER_POOL_ID'), help='Cognito User Pool ID')
+    parser.add_argument('--stack-name', help='Read the User Pool ID from this CloudFormation stack')
+    parser.add_argument('--output', default=str(DEFAULT_OUTPUT), help='Where to write the JWKS')
+    return parser.parse_args()
+
+
+def get_user_pool_id_from_stack(stack_name, region):
+    """
+    Look up the Cognito User Pool ID in the outputs of a deployed stack.
+
+    Args:
+        stack_name: CloudFormation stack name
+        region: AWS region of the stack
+
+    Returns:
+        The User Pool ID, or None if the stack has no such output
+    """
+    import boto3
+
+    cloudformation = boto3.client('cloudformation', region_name=region)
+    response = cloudformation.describe_stacks(StackName=stack_name)
+    for output in response['Stacks'][0].get('Outputs', []):
+        if output['OutputKey'] == 'CognitoUserPoolId':
+            return output['OutputValue']
+    return None
+
+
+def fetch_jwks(region, user_pool_id):
+    """
+    Download the JWKS document for a Cognito User Pool.
+
+    Args:
+        region: AWS region of the user pool
+        user_pool_id: Cognito User Pool ID
+
+    Returns:
+        The parsed JWKS document
+    """
+    url = f'https://cognito-idp.{region}.amazonaws.com/{user_pool_id}/.well-known/jwks.json'
+    with urllib.request.urlopen(url, timeout=10) as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+def main():
+    """Main function."""
+    args = parse_args()
+
+    user_pool_id = args.user_pool_id
+    if args.stack_name:
+        user_pool_id = get_user_pool_id_from_stack(args.stack_name, args.region)
+
+    if not user_pool_id:
+        print("Error: No User Pool ID found. Use --user-pool-id, --stack-name or set USER_POOL_ID.")
+        sys.exit(1)
+
+    jwks = fetch_jwks(args.region, user_pool_id)
+    if not jwks.get('keys'):
+        print(f"Error: JWKS for user pool {user_pool_id} contains no keys")
+        sys.exit(1)
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(jwks, f, indent=2)
+
+    print(f"Wrote {len(jwks['keys'])} keys for user pool {user_pool_id} to {output}")
+
+
+if __name__ == '__main__':
+    main()
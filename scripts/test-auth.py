@@ -7,6 +7,7 @@ requests to the Campo Vision API.
 
 Usage:
     python test-auth.py
+    python test-auth.py --emails-file users.txt    # bulk-create test users
 
 Environment variables:
     AWS_REGION - AWS region (default: us-east-1)
@@ -19,9 +20,13 @@ Environment variables:
 
 import os
 import json
+import time
+import random
 import boto3
 import requests
 import argparse
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 # Parse command line arguments
@@ -33,6 +38,7 @@ parser.add_argument('--api-endpoint', help='API Gateway Endpoint URL', default=o
 parser.add_argument('--username', help='Cognito Username (email)', default=os.environ.get('USERNAME'))
 parser.add_argument('--password', help='Cognito Password', default=os.environ.get('PASSWORD'))
 parser.add_argument('--create-user', action='store_true', help='Create a new user if it does not exist')
+parser.add_argument('--emails-file', help='Create a test user for every email in this file (one per line), using --password')
 parser.add_argument('--device-id', help='Device ID for telemetry data', default='test-device-001')
 parser.add_argument('--action', choices=['auth', 'ingest', 'get'], default='auth', 
                     help='Action to perform: auth (authenticate only), ingest (send telemetry), get (retrieve telemetry)')
@@ -40,15 +46,91 @@ parser.add_argument('--action', choices=['auth', 'ingest', 'get'], default='auth
 args = parser.parse_args()
 
 # Validate required arguments
-required_args = ['user_pool_id', 'client_id', 'api_endpoint', 'username', 'password']
+if args.emails_file:
+    required_args = ['user_pool_id', 'password']
+else:
+    required_args = ['user_pool_id', 'client_id', 'api_endpoint', 'username', 'password']
 missing_args = [arg for arg in required_args if not getattr(args, arg)]
 if missing_args:
     print(f"Error: Missing required arguments: {', '.join(missing_args)}")
     print("Please provide them as command line arguments or environment variables.")
     exit(1)
 
-# Initialize Cognito Identity Provider client
-cognito_idp = boto3.client('cognito-idp', region_name=args.region)
+# Bulk user creation runs up to this many Cognito calls in parallel
+CREATE_USER_WORKERS = 8
+CREATE_USER_MAX_ATTEMPTS = 5
+
+# Initialize Cognito Identity Provider client, shared by all worker threads
+cognito_idp = boto3.client(
+    'cognito-idp',
+    region_name=args.region,
+    config=Config(max_pool_connections=16, retries={'mode': 'adaptive'})
+)
+
+def call_with_retry(operation, **kwargs):
+    """Call a Cognito operation, backing off with jitter when Cognito throttles"""
+    for attempt in range(CREATE_USER_MAX_ATTEMPTS):
+        try:
+            return operation(**kwargs)
+        except cognito_idp.exceptions.TooManyRequestsException:
+            if attempt == CREATE_USER_MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(random.uniform(0, 0.2 * (2 ** attempt)))
+
+def create_user(username):
+    """Create a user in Cognito with a permanent password"""
+    # Each call is retried on its own so a throttled password update doesn't
+    # repeat the (already successful) user creation
+    call_with_retry(
+        cognito_idp.admin_create_user,
+        UserPoolId=args.user_pool_id,
+        Username=username,
+        TemporaryPassword=args.password,
+        UserAttributes=[
+            {
+                'Name': 'email',
+                'Value': username
+            },
+            {
+                'Name': 'email_verified',
+                'Value': 'true'
+            },
+            {
+                'Name': 'name',
+                'Value': 'Test User'
+            }
+        ]
+    )
+    
+    # Set permanent password
+    call_with_retry(
+        cognito_idp.admin_set_user_password,
+        UserPoolId=args.user_pool_id,
+        Username=username,
+        Password=args.password,
+        Permanent=True
+    )
+
+def create_users_from_file(path):
+    """Create a test user for every email listed in a file"""
+    with open(path) as f:
+        usernames = [line.strip() for line in f if line.strip()]
+    
+    created = 0
+    with ThreadPoolExecutor(max_workers=CREATE_USER_WORKERS) as executor:
+        futures = {executor.submit(create_user, username): username for username in usernames}
+        for future in as_completed(futures):
+            username = futures[future]
+            try:
+                future.result()
+                created += 1
+                print(f"Created new user: {username}")
+            except cognito_idp.exceptions.UsernameExistsException:
+                print(f"User {username} already exists")
+            except Exception as e:
+                print(f"Error creating user {username}: {str(e)}")
+    
+    print(f"Created {created} of {len(usernames)} users")
 
 def create_user_if_not_exists():
     """Create a new user in Cognito if it doesn't exist"""
@@ -63,35 +145,7 @@ def create_user_if_not_exists():
     except cognito_idp.exceptions.UserNotFoundException:
         if args.create_user:
             try:
-                # Create new user
-                cognito_idp.admin_create_user(
-                    UserPoolId=args.user_pool_id,
-                    Username=args.username,
-                    TemporaryPassword=args.password,
-                    UserAttributes=[
-                        {
-                            'Name': 'email',
-                            'Value': args.username
-                        },
-                        {
-                            'Name': 'email_verified',
-                            'Value': 'true'
-                        },
-                        {
-                            'Name': 'name',
-                            'Value': 'Test User'
-                        }
-                    ]
-                )
-                
-                # Set permanent password
-                cognito_idp.admin_set_user_password(
-                    UserPoolId=args.user_pool_id,
-                    Username=args.username,
-                    Password=args.password,
-                    Permanent=True
-                )
-                
+                create_user(args.username)
                 print(f"Created new user: {args.username}")
                 return True
             except Exception as e:
@@ -197,6 +251,11 @@ def get_telemetry(access_token):
 
 def main():
     """Main function"""
+    # Bulk-create test users and stop there
+    if args.emails_file:
+        create_users_from_file(args.emails_file)
+        return
+    
     # Create user if requested
     if args.create_user and not create_user_if_not_exists():
         return
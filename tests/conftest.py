@@ -0,0 +1,45 @@
+"""Shared fixtures for loading the Lambda handlers and scripts under test."""
+
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The handlers read their configuration at import time
+os.environ.update({
+    'AWS_REGION': 'us-east-1',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'LAMBDA_TASK_ROOT': '/var/task',
+    'USER_POOL_ID': 'us-east-1_testpool',
+    'USER_POOL_CLIENT_ID': 'test-client',
+    'TELEMETRY_TABLE': 'TelemetryTable',
+    'LATEST_TELEMETRY_TABLE': 'LatestTelemetryTable',
+    'COMPANY_TABLE': 'CompanyTable',
+    'USER_COMPANY_TABLE': 'UserCompanyTable',
+    'DEVICE_TABLE': 'DeviceTable',
+})
+
+# Modules from the Lambda layer and the scripts directory
+sys.path.insert(0, os.path.join(ROOT, 'layers', 'python'))
+sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+
+
+def load_function(name):
+    """Import functions/<name>/app.py as its own module"""
+    path = os.path.join(ROOT, 'functions', name, 'app.py')
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    """Skip the backoff sleeps of retry loops"""
+    import time
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
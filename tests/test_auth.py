@@ -0,0 +1,78 @@
+"""Tests for the verified-claims cache in the auth layer."""
+
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import auth
+
+KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def make_token(**overrides):
+    claims = {
+        'sub': 'user-1',
+        'iss': auth.ISSUER,
+        'exp': int(time.time()) + 3600,
+        'token_use': 'access',
+        'client_id': auth.USER_POOL_CLIENT_ID,
+    }
+    claims.update(overrides)
+    return jwt.encode(claims, KEY, algorithm='RS256', headers={'kid': 'test-key'})
+
+
+@pytest.fixture(autouse=True)
+def signing_key(monkeypatch):
+    monkeypatch.setattr(auth, 'public_keys', {'test-key': KEY.public_key()})
+    auth.claims_cache.clear()
+    yield
+    auth.claims_cache.clear()
+
+
+def test_cached_claims_skip_verification(monkeypatch):
+    token = make_token()
+    claims = auth.validate_token(token)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('token was decoded again')
+
+    monkeypatch.setattr(auth.jwt, 'decode', fail)
+    assert auth.validate_token(token) == claims
+
+
+def test_cached_claims_expire_with_the_token(monkeypatch):
+    token = make_token()
+    claims = auth.validate_token(token)
+    cache_key = token.encode('ascii').rpartition(b'.')[2]
+    assert cache_key in auth.claims_cache
+
+    later = claims['exp'] - auth.CLAIMS_CACHE_EXPIRY_MARGIN
+    monkeypatch.setattr(auth.time, 'time', lambda: later)
+
+    assert auth.get_cached_claims(cache_key, token.encode('ascii')) is None
+    assert cache_key not in auth.claims_cache
+
+
+def test_same_signature_with_other_payload_is_rejected():
+    token = make_token()
+    auth.validate_token(token)
+
+    # Splice the cached token's signature onto a different payload
+    header, _, signature = token.split('.')
+    forged_payload = make_token(sub='someone-else').split('.')[1]
+    forged = f'{header}.{forged_payload}.{signature}'
+
+    with pytest.raises(Exception, match='Signature verification failed'):
+        auth.validate_token(forged)
+
+
+def test_cache_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(auth, 'CLAIMS_CACHE_SIZE', 2)
+    first, second, third = (make_token(sub=f'user-{i}') for i in range(3))
+    for token in (first, second, third):
+        auth.validate_token(token)
+
+    keys = [token.encode('ascii').rpartition(b'.')[2] for token in (first, second, third)]
+    assert list(auth.claims_cache) == keys[1:]
@@ -0,0 +1,60 @@
+"""Tests for backfill_latest_telemetry."""
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+import backfill_latest_telemetry as backfill
+
+READING = {'deviceId': {'S': 'd1'}, 'timestamp': {'S': '2024-01-01T00:00:00Z'}, 'temperature': {'N': '20'}}
+
+
+@pytest.fixture
+def client():
+    client = boto3.client('dynamodb', region_name='us-east-1')
+    with Stubber(client) as stub:
+        yield client, stub
+        stub.assert_no_pending_responses()
+
+
+def newest_reading(stub, items):
+    stub.add_response('query', {'Items': items}, {
+        'TableName': 'TelemetryTable',
+        'KeyConditionExpression': 'deviceId = :deviceId',
+        'ExpressionAttributeValues': {':deviceId': {'S': 'd1'}},
+        'ScanIndexForward': False,
+        'Limit': 1,
+    })
+
+
+def run(client):
+    return backfill.backfill_device(client, 'TelemetryTable', 'LatestTelemetryTable', 'd1')
+
+
+def test_newest_reading_is_copied(client):
+    client, stub = client
+    newest_reading(stub, [READING])
+    stub.add_response('put_item', {}, {
+        'TableName': 'LatestTelemetryTable',
+        'Item': READING,
+        'ConditionExpression': 'attribute_not_exists(deviceId) OR #ts < :ts',
+        'ExpressionAttributeNames': {'#ts': 'timestamp'},
+        'ExpressionAttributeValues': {':ts': READING['timestamp']},
+    })
+
+    assert run(client) == 'written'
+
+
+def test_newer_snapshot_is_kept(client):
+    client, stub = client
+    newest_reading(stub, [READING])
+    stub.add_client_error('put_item', 'ConditionalCheckFailedException')
+
+    assert run(client) == 'current'
+
+
+def test_device_without_telemetry_is_skipped(client):
+    client, stub = client
+    newest_reading(stub, [])
+
+    assert run(client) == 'no telemetry'
@@ -0,0 +1,111 @@
+"""Tests for the segmented scan-and-delete pipeline in clear_dynamodb_tables."""
+
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+import clear_dynamodb_tables as clear
+
+PAGE_SIZE = 10
+
+
+def client_error(operation):
+    return ClientError({'Error': {'Code': 'InternalServerError', 'Message': 'boom'}}, operation)
+
+
+class FakeTable:
+    """A hash + range key table whose scan splits items into segments"""
+
+    key_schema = [
+        {'AttributeName': 'deviceId', 'KeyType': 'HASH'},
+        {'AttributeName': 'timestamp', 'KeyType': 'RANGE'},
+    ]
+
+    def __init__(self, count):
+        self.items = {
+            (f'd{i % 7}', f't{i:05}'): {'deviceId': f'd{i % 7}', 'timestamp': f't{i:05}', 'payload': 'x' * 50}
+            for i in range(count)
+        }
+        self.scans = []
+        self.fail_segment = None
+        self.lock = threading.Lock()
+
+    def scan(self, Segment, TotalSegments, ExclusiveStartKey=None, **kwargs):
+        with self.lock:
+            self.scans.append(dict(kwargs, Segment=Segment, TotalSegments=TotalSegments))
+            if Segment == self.fail_segment:
+                raise client_error('Scan')
+            keys = sorted(key for key in self.items if int(key[1][1:]) % TotalSegments == Segment)
+        if ExclusiveStartKey:
+            start = (ExclusiveStartKey['deviceId'], ExclusiveStartKey['timestamp'])
+            keys = [key for key in keys if key > start]
+        page = keys[:PAGE_SIZE]
+        response = {'Items': [{'deviceId': key[0], 'timestamp': key[1]} for key in page]}
+        if len(keys) > PAGE_SIZE:
+            response['LastEvaluatedKey'] = {'deviceId': page[-1][0], 'timestamp': page[-1][1]}
+        return response
+
+
+class FakeDynamoDB:
+    def __init__(self, table):
+        self.table = table
+        self.fail_writes = False
+
+    def Table(self, name):
+        return self.table
+
+    def batch_write_item(self, RequestItems):
+        requests = RequestItems['table']
+        assert len(requests) <= 25
+        if self.fail_writes:
+            raise client_error('BatchWriteItem')
+        with self.table.lock:
+            for request in requests:
+                key = request['DeleteRequest']['Key']
+                self.table.items.pop((key['deviceId'], key['timestamp']), None)
+        return {'UnprocessedItems': {}}
+
+
+def clear_with_timeout(dynamodb, segments):
+    """Run clear_table in a thread so a deadlock fails the test instead of hanging it"""
+    result = []
+    worker = threading.Thread(target=lambda: result.append(clear.clear_table(dynamodb, 'table', segments)))
+    worker.start()
+    worker.join(timeout=30)
+    assert not worker.is_alive(), 'clear_table did not finish'
+    return result[0]
+
+
+@pytest.mark.parametrize('segments', [1, 4])
+def test_every_segment_is_scanned_and_deleted(segments):
+    table = FakeTable(1000)
+
+    assert clear_with_timeout(FakeDynamoDB(table), segments) is True
+
+    assert table.items == {}
+    assert {scan['Segment'] for scan in table.scans} == set(range(segments))
+    assert all(scan['TotalSegments'] == segments for scan in table.scans)
+    assert table.scans[0]['ProjectionExpression'] == '#h, #r'
+    assert table.scans[0]['ExpressionAttributeNames'] == {'#h': 'deviceId', '#r': 'timestamp'}
+
+
+def test_empty_table_is_left_alone():
+    assert clear_with_timeout(FakeDynamoDB(FakeTable(0)), 4) is True
+
+
+def test_scan_error_fails_the_table():
+    table = FakeTable(1000)
+    table.fail_segment = 2
+
+    assert clear_with_timeout(FakeDynamoDB(table), 4) is False
+
+
+def test_delete_error_stops_the_scanners():
+    # Far more batches than the queue holds, so the scanners block on it
+    table = FakeTable(5000)
+    dynamodb = FakeDynamoDB(table)
+    dynamodb.fail_writes = True
+
+    assert clear_with_timeout(dynamodb, 4) is False
+    assert len(table.items) == 5000
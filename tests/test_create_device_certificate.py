@@ -0,0 +1,77 @@
+"""Tests for batched device registration in create_device_certificate."""
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+import create_device_certificate as provisioning
+
+
+class FakeDynamoDB:
+    """Answers BatchWriteItem calls from a list of responses or errors"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def batch_write_item(self, RequestItems):
+        self.calls.append(RequestItems)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def dynamodb(monkeypatch):
+    def install(*responses):
+        fake = FakeDynamoDB(*responses)
+        monkeypatch.setattr(provisioning, 'get_dynamodb', lambda: fake)
+        return fake
+    return install
+
+
+def device(index):
+    return {'deviceId': f'd{index}', 'companyId': 'c1', 'thingName': f'campo-vision-d{index}', 'certificateId': f'cert-{index}'}
+
+
+def register(count):
+    with provisioning.BulkDeviceRegistrar('DeviceTable') as registrar:
+        for index in range(count):
+            registrar.put(device(index))
+    return registrar
+
+
+def unprocessed(*device_ids):
+    return {'UnprocessedItems': {'DeviceTable': [
+        {'PutRequest': {'Item': {'deviceId': device_id}}} for device_id in device_ids
+    ]}}
+
+
+def test_devices_are_written_in_batches_of_25(dynamodb):
+    fake = dynamodb({'UnprocessedItems': {}}, {'UnprocessedItems': {}})
+
+    registrar = register(30)
+
+    assert [len(call['DeviceTable']) for call in fake.calls] == [25, 5]
+    assert registrar.failed == {}
+
+
+@pytest.mark.parametrize('error', [
+    EndpointConnectionError(endpoint_url='https://dynamodb.us-east-1.amazonaws.com'),
+    ClientError({'Error': {'Code': 'InternalServerError', 'Message': 'boom'}}, 'BatchWriteItem'),
+])
+def test_write_errors_fail_every_unwritten_device(dynamodb, no_sleep, error):
+    dynamodb({'UnprocessedItems': {}}, unprocessed('d25', 'd27'), error)
+
+    registrar = register(30)
+
+    assert sorted(registrar.failed) == ['d25', 'd27']
+    assert all(message == str(error) for message in registrar.failed.values())
+
+
+def test_items_left_unprocessed_after_retries_fail(dynamodb, no_sleep):
+    dynamodb(*[unprocessed('d1')] * provisioning.BATCH_WRITE_MAX_ATTEMPTS)
+
+    registrar = register(2)
+
+    assert registrar.failed == {'d1': 'still unprocessed after retries'}
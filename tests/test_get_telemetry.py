@@ -0,0 +1,49 @@
+"""Tests for the paginated telemetry query in the get-telemetry function."""
+
+from types import SimpleNamespace
+
+import boto3
+import orjson
+import pytest
+from botocore.stub import Stubber
+
+from conftest import load_function
+
+app = load_function('get-telemetry')
+
+
+@pytest.fixture
+def stubber(monkeypatch):
+    client = boto3.client('dynamodb', region_name='us-east-1')
+    monkeypatch.setattr(app, 'dynamodb', client)
+    monkeypatch.setattr(app, 'get_auth', lambda: SimpleNamespace(require_auth=lambda event: {}))
+    with Stubber(client) as stub:
+        yield stub
+        stub.assert_no_pending_responses()
+
+
+def request(**params):
+    return {'httpMethod': 'GET', 'queryStringParameters': dict(deviceId='d1', **params)}
+
+
+def test_limit_sets_the_page_size(stubber):
+    stubber.add_response('query', {
+        'Items': [{'deviceId': {'S': 'd1'}, 'timestamp': {'S': '2024-01-01T00:00:00Z'}}]
+    }, {
+        'TableName': 'TelemetryTable',
+        'KeyConditionExpression': 'deviceId = :deviceId',
+        'ExpressionAttributeValues': {':deviceId': {'S': 'd1'}},
+        'Limit': 10,
+    })
+
+    response = app.lambda_handler(request(limit='10'), None)
+
+    assert response['statusCode'] == 200
+    assert orjson.loads(response['body'])['count'] == 1
+
+
+@pytest.mark.parametrize('limit', ['0', '-5'])
+def test_non_positive_limit_is_a_bad_request(stubber, limit):
+    response = app.lambda_handler(request(limit=limit), None)
+
+    assert response['statusCode'] == 400
@@ -0,0 +1,121 @@
+"""Tests for SQS/Kinesis batch handling in the ingest-telemetry function."""
+
+import base64
+import json
+from types import SimpleNamespace
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import ANY, Stubber
+
+from conftest import load_function
+
+app = load_function('ingest-telemetry')
+
+
+def message(device_id, timestamp, **extra):
+    body = {'deviceId': device_id, 'timestamp': timestamp, 'latitude': 1.5, 'longitude': 2.5, 'temperature': 20}
+    body.update(extra)
+    return body
+
+
+def sqs_record(message_id, body):
+    return {'messageId': message_id, 'body': body if isinstance(body, str) else json.dumps(body)}
+
+
+def kinesis_record(sequence_number, data):
+    return {'kinesis': {'sequenceNumber': sequence_number, 'data': data}}
+
+
+@pytest.fixture
+def stubber(monkeypatch):
+    client = boto3.client('dynamodb', region_name='us-east-1')
+    monkeypatch.setattr(app, 'dynamodb', client)
+    with Stubber(client) as stub:
+        yield stub
+        stub.assert_no_pending_responses()
+
+
+def expect_latest_put(stubber, timestamp):
+    stubber.add_response('put_item', {}, {
+        'TableName': 'LatestTelemetryTable',
+        'Item': ANY,
+        'ConditionExpression': 'attribute_not_exists(deviceId) OR #ts < :ts',
+        'ExpressionAttributeNames': {'#ts': 'timestamp'},
+        'ExpressionAttributeValues': {':ts': {'S': timestamp}},
+    })
+
+
+def test_unprocessed_items_are_reported_as_batch_item_failures(stubber, no_sleep):
+    event = {'Records': [
+        sqs_record('m1', message('d1', '2024-01-01T00:00:00Z')),
+        sqs_record('m2', message('d1', '2024-01-01T00:01:00Z')),
+    ]}
+    items = [app.build_telemetry_item(json.loads(r['body'])) for r in event['Records']]
+
+    stubber.add_response('batch_write_item', {
+        'UnprocessedItems': {'TelemetryTable': [{'PutRequest': {'Item': items[0]}}]}
+    })
+    for _ in range(app.BATCH_WRITE_MAX_ATTEMPTS - 1):
+        stubber.add_response('batch_write_item', {
+            'UnprocessedItems': {'TelemetryTable': [{'PutRequest': {'Item': items[0]}}]}
+        }, {'RequestItems': {'TelemetryTable': [{'PutRequest': {'Item': items[0]}}]}})
+    expect_latest_put(stubber, '2024-01-01T00:01:00Z')
+
+    assert app.lambda_handler(event, None) == {'batchItemFailures': [{'itemIdentifier': 'm1'}]}
+
+
+def test_invalid_records_are_dropped(stubber):
+    event = {'Records': [
+        kinesis_record('1', '***not base64***'),
+        kinesis_record('2', base64.b64encode(b'\xff\xfe').decode()),
+        sqs_record('m3', '{not json'),
+        sqs_record('m4', '[1, 2]'),
+        sqs_record('m5', {'deviceId': 'd1'}),
+        sqs_record('m6', message(123, '2024-01-01T00:00:00Z')),
+        sqs_record('m7', message('', '2024-01-01T00:00:00Z')),
+        sqs_record('m8', message('d1', 1704067200)),
+        sqs_record('m9', message('d1', '2024-01-01T00:00:00Z', latitude='abc')),
+        sqs_record('m10', message('d1', '2024-01-01T00:00:00Z', longitude=None)),
+        sqs_record('m11', message('d1', '2024-01-01T00:00:00Z', temperature=True)),
+        sqs_record('m12', message('d1', '2024-01-01T00:00:00Z')),
+    ]}
+
+    stubber.add_response('batch_write_item', {'UnprocessedItems': {}}, {
+        'RequestItems': {'TelemetryTable': [{'PutRequest': {'Item': ANY}}]}
+    })
+    expect_latest_put(stubber, '2024-01-01T00:00:00Z')
+
+    assert app.lambda_handler(event, None) == {'batchItemFailures': []}
+
+
+def test_write_errors_propagate_so_the_batch_is_retried(stubber):
+    event = {'Records': [sqs_record('m1', message('d1', '2024-01-01T00:00:00Z'))]}
+    stubber.add_client_error('batch_write_item', 'ProvisionedThroughputExceededException')
+
+    with pytest.raises(ClientError):
+        app.lambda_handler(event, None)
+
+
+def test_older_reading_does_not_replace_latest(stubber):
+    event = {'Records': [sqs_record('m1', message('d1', '2023-01-01T00:00:00Z'))]}
+    stubber.add_response('batch_write_item', {'UnprocessedItems': {}})
+    stubber.add_client_error('put_item', 'ConditionalCheckFailedException')
+
+    assert app.lambda_handler(event, None) == {'batchItemFailures': []}
+
+
+@pytest.mark.parametrize('body, error', [
+    (message(123, '2024-01-01T00:00:00Z'), 'deviceId must be a non-empty string'),
+    (message('d1', '2024-01-01T00:00:00Z', latitude='abc'), 'latitude must be a number'),
+    (message('d1', '2024-01-01T00:00:00Z', temperature=False), 'temperature must be a number'),
+    ([1, 2], 'Telemetry message must be a JSON object'),
+])
+def test_invalid_api_messages_are_bad_requests(monkeypatch, stubber, body, error):
+    monkeypatch.setattr(app, 'get_auth', lambda: SimpleNamespace(require_auth=lambda event: {}))
+
+    response = app.lambda_handler({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+
+    assert response['statusCode'] == 400
+    assert json.loads(response['body']) == {'error': error}
@@ -0,0 +1,75 @@
+"""Tests for the admin-check transactions in the manage-company function."""
+
+import json
+
+import orjson
+import pytest
+from botocore.stub import Stubber
+
+from conftest import load_function
+
+app = load_function('manage-company')
+
+CONDITION_FAILED = {'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'}
+NO_FAILURE = {'Code': 'None'}
+
+
+@pytest.fixture
+def stubber():
+    with Stubber(app.dynamodb.meta.client) as stub:
+        yield stub
+        stub.assert_no_pending_responses()
+
+
+def cancel_transaction(stubber, reasons):
+    stubber.add_client_error(
+        'transact_write_items',
+        service_error_code='TransactionCanceledException',
+        modeled_fields={'CancellationReasons': reasons}
+    )
+
+
+def request(company_id='c1', **fields):
+    return {'body': json.dumps(dict(companyId=company_id, **fields))}
+
+
+def test_update_by_non_admin_is_forbidden(stubber):
+    cancel_transaction(stubber, [CONDITION_FAILED, NO_FAILURE])
+
+    response = app.update_company(request(name='New name'), 'user-1')
+
+    assert response['statusCode'] == 403
+
+
+def test_update_of_missing_company_is_not_found(stubber):
+    cancel_transaction(stubber, [NO_FAILURE, CONDITION_FAILED])
+
+    response = app.update_company(request(name='New name'), 'user-1')
+
+    assert response['statusCode'] == 404
+    assert orjson.loads(response['body']) == {'message': 'Company not found'}
+
+
+def test_update_by_admin_succeeds(stubber):
+    stubber.add_response('transact_write_items', {})
+
+    response = app.update_company(request(name='New name'), 'user-1')
+
+    assert response['statusCode'] == 200
+    assert orjson.loads(response['body'])['company']['name'] == 'New name'
+
+
+def test_delete_by_non_admin_is_forbidden(stubber):
+    cancel_transaction(stubber, [CONDITION_FAILED, NO_FAILURE])
+
+    response = app.delete_company(request(), 'user-1')
+
+    assert response['statusCode'] == 403
+
+
+def test_other_cancellations_are_server_errors(stubber):
+    cancel_transaction(stubber, [NO_FAILURE, {'Code': 'TransactionConflict'}])
+
+    response = app.update_company(request(name='New name'), 'user-1')
+
+    assert response['statusCode'] == 500
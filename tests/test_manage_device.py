@@ -0,0 +1,58 @@
+"""Tests for device registration in the manage-device function."""
+
+import json
+
+import boto3
+import orjson
+import pytest
+from botocore.stub import ANY, Stubber
+
+from conftest import load_function
+
+app = load_function('manage-device')
+
+
+@pytest.fixture
+def dynamodb():
+    with Stubber(app.dynamodb.meta.client) as stub:
+        yield stub
+        stub.assert_no_pending_responses()
+
+
+@pytest.fixture
+def iot(monkeypatch):
+    client = boto3.client('iot', region_name='us-east-1')
+    monkeypatch.setattr(app, 'iot_client', client)
+    with Stubber(client) as stub:
+        yield stub
+        stub.assert_no_pending_responses()
+
+
+def request():
+    return {'body': json.dumps({'deviceId': 'd1', 'companyId': 'c1', 'name': 'Tractor'})}
+
+
+def test_thing_is_created_after_the_device_is_saved(dynamodb, iot):
+    dynamodb.add_response('put_item', {})
+    iot.add_response('create_thing', {'thingName': 'd1'}, {
+        'thingName': 'd1',
+        'attributePayload': {'attributes': {'companyId': 'c1', 'name': 'Tractor', 'description': ''}}
+    })
+
+    response = app.register_device(request(), 'user-1')
+
+    assert response['statusCode'] == 201
+    assert orjson.loads(response['body'])['iotRegistrationSuccess'] is True
+
+
+@pytest.mark.parametrize('code, status', [('ConditionalCheckFailedException', 409), ('InternalServerError', 500)])
+def test_failed_save_does_not_create_a_thing(dynamodb, iot, code, status):
+    dynamodb.add_client_error('put_item', code, expected_params={
+        'TableName': 'DeviceTable',
+        'Item': ANY,
+        'ConditionExpression': 'attribute_not_exists(deviceId)'
+    })
+
+    response = app.register_device(request(), 'user-1')
+
+    assert response['statusCode'] == status
@@ -0,0 +1,114 @@
+"""Tests for bulk assignments in the manage-user-company function."""
+
+import boto3
+import orjson
+import pytest
+from botocore.stub import ANY, Stubber
+
+from conftest import load_function
+
+app = load_function('manage-user-company')
+
+CLAIMS = {'sub': 'admin-1', 'cognito:groups': ['admin']}
+
+
+@pytest.fixture
+def dynamodb():
+    with Stubber(app.dynamodb.meta.client) as stub:
+        yield stub
+        stub.assert_no_pending_responses()
+
+
+@pytest.fixture
+def cognito(monkeypatch):
+    client = boto3.client('cognito-idp', region_name='us-east-1')
+    monkeypatch.setattr(app, 'cognito', client)
+    with Stubber(client) as stub:
+        yield stub
+        stub.assert_no_pending_responses()
+
+
+def companies_found(stub, *company_ids):
+    stub.add_response('batch_get_item', {
+        'Responses': {'CompanyTable': [{'companyId': {'S': company_id}} for company_id in company_ids]}
+    })
+
+
+def user_found(stub, user_id):
+    stub.add_response('admin_get_user', {
+        'Username': user_id,
+        'UserAttributes': [{'Name': 'email', 'Value': f'{user_id}@example.com'}]
+    }, {'UserPoolId': 'us-east-1_testpool', 'Username': user_id})
+
+
+def memberships_written(stub, *keys):
+    stub.add_response('batch_write_item', {'UnprocessedItems': {}}, {
+        'RequestItems': {'UserCompanyTable': [
+            {'PutRequest': {'Item': {
+                'userId': user_id,
+                'companyId': company_id,
+                'role': ANY,
+                'createdBy': 'admin-1',
+                'createdAt': ANY,
+                'updatedAt': ANY,
+            }}}
+            for user_id, company_id in keys
+        ]}
+    })
+
+
+def body(response):
+    return orjson.loads(response['body'])
+
+
+@pytest.mark.parametrize('assignments', [[], [{'userId': 'u1', 'companyId': 'c1'}] * 101])
+def test_assignment_count_is_limited(assignments):
+    response = app.assign_users(assignments, CLAIMS)
+
+    assert response['statusCode'] == 400
+
+
+def test_invalid_assignments_fail_individually(dynamodb, cognito):
+    assignments = [
+        'not an object',
+        {'userId': 'u1'},
+        {'userId': {'nested': 'id'}, 'companyId': 'c1'},
+        {'userId': 'u1', 'companyId': 42},
+    ]
+
+    response = app.assign_users(assignments, CLAIMS)
+
+    assert response['statusCode'] == 200
+    result = body(response)
+    assert result['assigned'] == []
+    assert [failure['assignment'] for failure in result['failed']] == assignments
+    assert result['failed'][2]['error'] == 'userId and companyId must be strings'
+
+
+def test_missing_companies_are_reported(dynamodb, cognito):
+    companies_found(dynamodb, 'c1')
+    user_found(cognito, 'u1')
+    memberships_written(dynamodb, ('u1', 'c1'))
+
+    response = app.assign_users([
+        {'userId': 'u1', 'companyId': 'c1', 'role': 'admin'},
+        {'userId': 'u1', 'companyId': 'c2'},
+    ], CLAIMS)
+
+    result = body(response)
+    assert result['assigned'] == [{'userId': 'u1', 'companyId': 'c1', 'role': 'admin'}]
+    assert result['failed'] == [{
+        'assignment': {'userId': 'u1', 'companyId': 'c2'},
+        'error': 'Company with ID c2 not found'
+    }]
+
+
+def test_missing_users_are_reported(dynamodb, cognito):
+    companies_found(dynamodb, 'c1')
+    cognito.add_client_error('admin_get_user', 'UserNotFoundException')
+
+    response = app.assign_users([{'userId': 'ghost', 'companyId': 'c1'}], CLAIMS)
+
+    result = body(response)
+    assert result['assigned'] == []
+    assert result['failed'][0]['error'] == 'User with ID ghost not found'